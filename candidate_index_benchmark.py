@@ -0,0 +1,63 @@
+import random, sys, time
+from levenshtein import distance_within, LevenshteinIndex
+
+# Compare candidate retrieval by scanning the vocabulary with distance_within against LevenshteinIndex.
+if not (len(sys.argv) in [1, 2]):
+    print('Usage: python3 candidate_index_benchmark.py [VOCABULARY_FILE]')
+    sys.exit(-1)
+
+max_distance = 4
+queries_n = 20
+rng = random.Random(0)
+letters = 'aąbcćdeęfghijklłmnńoóprsśtuwyzźż'
+
+def random_word():
+    return 'k' + ''.join([rng.choice(letters) for i in range(rng.randint(2, 9))])
+
+def misspell(word):
+    "Make up to two random edits to the word, not touching the first letter."
+    for i in range(rng.randint(0, 2)):
+        pos = rng.randint(1, len(word))
+        edit = rng.choice(['insert', 'delete', 'substitute'])
+        if edit == 'insert' or pos == len(word):
+            word = word[:pos] + rng.choice(letters) + word[pos:]
+        elif edit == 'delete' and len(word) > 2:
+            word = word[:pos] + word[pos+1:]
+        else:
+            word = word[:pos] + rng.choice(letters) + word[pos+1:]
+    return word
+
+if len(sys.argv) == 2:
+    with open(sys.argv[1]) as fl:
+        all_words = [line.strip() for line in fl if line.strip()]
+    sizes = [n for n in [1000, 10000, 100000] if n < len(all_words)] + [len(all_words)]
+else:
+    # Synthetic words all starting with the same letter, as in one bucket of the vocabulary.
+    all_words = [random_word() for i in range(100000)]
+    sizes = [1000, 10000, 100000]
+
+print('{:>8} {:>12} {:>12} {:>12} {:>9} {:>10}'.format('words', 'build (s)', 'scan (ms)', 'index (ms)',
+                                                        'speedup', 'candidates'))
+for size in sizes:
+    words = rng.sample(all_words, size)
+    queries = [misspell(rng.choice(words)) for i in range(queries_n)]
+
+    start = time.perf_counter()
+    index = LevenshteinIndex(words)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scanned = [[(w, distance) for (w, distance) in [(w, distance_within(w, query, max_distance)) for w in words]
+                if distance is not False]
+               for query in queries]
+    scan_time = (time.perf_counter() - start) / queries_n
+
+    start = time.perf_counter()
+    searched = [index.search(query, max_distance) for query in queries]
+    index_time = (time.perf_counter() - start) / queries_n
+
+    if scanned != searched:
+        raise RuntimeError('the index and the scan found different candidates')
+    print('{:>8} {:>12.2f} {:>12.2f} {:>12.2f} {:>9.1f} {:>10.1f}'.format(
+        size, build_time, scan_time * 1000, index_time * 1000, scan_time / index_time,
+        sum([len(s) for s in searched]) / queries_n))
@@ -0,0 +1,62 @@
+import numpy as np
+import nest
+from neuro_reporting import timed, count
+
+class Projection:
+    """Connections of one synapse model, collected as source/target/weight arrays and made
+    with a single one-to-one nest.Connect, with weights set at creation time."""
+
+    def __init__(self, model='static_synapse', weighted=True):
+        self.model = model
+        self.weighted = weighted # if not, connections get the model's default weight
+        self.sources, self.targets, self.weights = [], [], []
+
+    def __len__(self):
+        return sum([len(s) for s in self.sources])
+
+    def add(self, sources, targets, weight=None):
+        "Add all-to-all connections from sources to targets. The weight may be a number or a syn_spec dict."
+        if isinstance(weight, dict):
+            weight = weight['weight']
+        sources, targets = np.asarray(sources, dtype=int), np.asarray(targets, dtype=int)
+        self.sources.append(np.repeat(sources, len(targets)))
+        self.targets.append(np.tile(targets, len(sources)))
+        if self.weighted:
+            self.weights.append(np.full(len(sources) * len(targets), weight, dtype=float))
+
+    def add_pairs(self, sources, targets, weights=None):
+        "Add one-to-one connections, with weights given for each pair (if the projection is weighted)."
+        self.sources.append(np.asarray(sources, dtype=int))
+        self.targets.append(np.asarray(targets, dtype=int))
+        if self.weighted:
+            self.weights.append(np.asarray(weights, dtype=float))
+
+    def add_column_pairs(self, source_cols, target_cols, weights=None):
+        """Add all-to-all connections within pairs of columns, given as arrays of neuron ids (pairs, column
+        size), with a weight for each pair (if the projection is weighted). The order of connections is
+        the same as with add called for each pair."""
+        source_cols, target_cols = np.asarray(source_cols, dtype=int), np.asarray(target_cols, dtype=int)
+        self.sources.append(np.repeat(source_cols, target_cols.shape[1], axis=1).ravel())
+        self.targets.append(np.tile(target_cols, (1, source_cols.shape[1])).ravel())
+        if self.weighted:
+            self.weights.append(np.repeat(np.asarray(weights, dtype=float), source_cols.shape[1] * target_cols.shape[1]))
+
+    def arrays(self):
+        "Get (sources, targets, weights) arrays of all connections added so far."
+        if not self.sources:
+            return (np.zeros(0, dtype=int), np.zeros(0, dtype=int), np.zeros(0))
+        return (np.concatenate(self.sources), np.concatenate(self.targets),
+                np.concatenate(self.weights) if self.weighted else None)
+
+    @timed('connect')
+    def connect(self):
+        "Make all connections in NEST and clear the projection."
+        sources, targets, weights = self.arrays()
+        count('connections_created', len(sources))
+        if len(sources) > 0:
+            syn_spec = { 'model': self.model }
+            if self.weighted:
+                syn_spec['weight'] = weights
+            nest.Connect(sources.tolist(), targets.tolist(), 'one_to_one', syn_spec)
+        self.sources, self.targets, self.weights = [], [], []
+        return len(sources)
@@ -0,0 +1,103 @@
+import hashlib, os, shutil
+from itertools import chain
+import numpy as np
+from language_data import cached_source_hash
+
+# Connectivity templates: the column-level connections of the reading scaffold which are fixed by the
+# language data (which letters belong to which head graphemes, grapheme neighbour inhibition, suffix
+# letter masks and suffix decompositions), derived once and kept as .npy files in the language data
+# directory. They are loaded memory-mapped, so processes share them instead of copying. Their weights
+# depend on prm, and are computed when a template is loaded (so changing the weights, as in parameter
+# sweeps, adds no files). Indices of letters, graphemes and suffixes are into the language's lists;
+# heads are in the order of the graphemes_by_lengths lists, chained.
+templates_dir_name = 'templates'
+template_format_version = 2
+
+loaded_templates = dict() # key -> template
+
+def template_weights(template, language, prm):
+    "Get the weight arrays of the template's connections for prm, as a dict (they are cheap to compute)."
+    grapheme_lateral = np.array([prm['grapheme_lateral_inhibition'](len(g))['weight'] for g in language.graphemes])
+    weights = { 'letter_head_weights': np.full(len(template['letter_head_letters']),
+                                               prm['letter_head_excitation']['weight']),
+                'grapheme_lateral_weights': np.tile(grapheme_lateral, len(language.graphemes)) }
+    if prm['stems_and_suffixes']:
+        weights['suffix_member_weights'] = np.array([prm['member_letter_excitation_suffix'](len(s))['weight']
+                                                     for s in suffix_list(language)])
+        weights['suffix_absent_weights'] = np.array([prm['absent_letter_inhibition_suffix'](len(s))['weight']
+                                                     for s in suffix_list(language)])
+    return weights
+
+def suffix_list(language):
+    "Get the suffixes without repetitions (as the reader's suffix columns)."
+    return list(dict.fromkeys(language.suffixes))
+
+def template_key(language_data_path, language, prm):
+    digest = hashlib.sha256()
+    digest.update(repr((template_format_version, cached_source_hash(language_data_path, prm['stems_and_suffixes']),
+                        prm['stems_and_suffixes'])).encode())
+    return digest.hexdigest()
+
+def compile_template(language, prm):
+    "Derive the template arrays (as a dict, without the weights) for the language and prm."
+    letters, graphemes = language.letters, language.graphemes
+    grapheme_ns = dict([(g, grapheme_n) for (grapheme_n, g) in enumerate(graphemes)])
+    heads = list(chain.from_iterable(language.graphemes_by_lengths))
+    template = dict()
+    template['head_graphemes'] = np.array([grapheme_ns[g] for g in heads], dtype=int)
+    # Letter -> head: a pair for each letter in each head grapheme, in the order of letters.
+    letter_head = [(letter_n, head_n) for (letter_n, letter) in enumerate(letters)
+                   for (head_n, g) in enumerate(heads) if letter in g]
+    template['letter_head_letters'] = np.array([pair[0] for pair in letter_head], dtype=int)
+    template['letter_head_heads'] = np.array([pair[1] for pair in letter_head], dtype=int)
+    # Grapheme -> neighbouring grapheme inhibition: every pair of graphemes (those containing at least
+    # one same letter, as the condition was written, which holds for all of them), weighted by the
+    # length of the target.
+    template['grapheme_lateral_sources'] = np.repeat(np.arange(len(graphemes)), len(graphemes))
+    template['grapheme_lateral_targets'] = np.tile(np.arange(len(graphemes)), len(graphemes))
+    if prm['stems_and_suffixes']:
+        suffixes = suffix_list(language)
+        template['suffix_lens'] = np.array([len(s) for s in suffixes], dtype=int)
+        template['suffix_letter_member'] = np.array([[letter in s for letter in letters] for s in suffixes],
+                                                    dtype=bool).reshape(len(suffixes), len(letters))
+        # Positions of graphemes in suffixes (suffix, grapheme, position -> count).
+        decompositions = [language.decompose(s) for s in suffixes]
+        positions = np.zeros((len(suffixes), len(graphemes), max([len(d) for d in decompositions] + [1])))
+        for (suffix_n, decomposition) in enumerate(decompositions):
+            for (ind, g) in enumerate(decomposition):
+                positions[suffix_n, grapheme_ns[g], ind] += 1
+        template['suffix_positions'] = positions
+    return template
+
+def save_template(path, template):
+    "Save the template arrays as .npy files in a new directory (which appears only when complete)."
+    temp_path = '{}.{}'.format(path.rstrip('/'), os.getpid())
+    os.makedirs(temp_path, exist_ok=True)
+    for (name, array) in template.items():
+        np.save(os.path.join(temp_path, name+'.npy'), array)
+    try:
+        os.rename(temp_path, path)
+    except OSError: # (saved by another process meanwhile)
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+def load_template(language_data_path, language, prm):
+    """Get the template for the language (loaded from language_data_path) and prm, compiling and saving
+    it when it is not saved yet. The arrays are memory-mapped and read-only, except the weights (see
+    template_weights)."""
+    key = template_key(language_data_path, language, prm)
+    if not key in loaded_templates:
+        loaded_templates[key] = load_template_arrays(language_data_path, language, prm, key)
+    return dict(loaded_templates[key], **template_weights(loaded_templates[key], language, prm))
+
+def load_template_arrays(language_data_path, language, prm, key):
+    "Load the saved template arrays with the key, compiling and saving them first when needed."
+    path = '{}{}/{}/'.format(language_data_path, templates_dir_name, key)
+    if not os.path.isdir(path):
+        template = compile_template(language, prm)
+        try:
+            os.makedirs(language_data_path+templates_dir_name, exist_ok=True)
+            save_template(path, template)
+        except OSError:
+            return template # the template is still usable, only not kept
+    return dict([(file_name[:-len('.npy')], np.load(path+file_name, mmap_mode='r'))
+                 for file_name in os.listdir(path) if file_name.endswith('.npy')])
@@ -0,0 +1,146 @@
+import hashlib, os, pickle
+from itertools import chain
+from unidecode import unidecode
+from levenshtein import LevenshteinIndex
+
+# The language data is read from plain files (letters, graphemes, stems or vocabulary, suffixes) and
+# kept in a compiled (pickled) form next to them, which is rebuilt when any of the source files change.
+compiled_file_name = 'compiled.pickle'
+compiled_format_version = 3
+decompositions_cache_size = 100000 # words outside the vocabulary with decompositions remembered
+
+class LanguageData:
+    """Letters, graphemes, vocabulary and suffixes of a language, with what is derived from them: the
+    vocabulary bucketed by (transliterated) first letter, Levenshtein indices of the buckets and
+    grapheme decompositions of all words and suffixes."""
+
+    def __init__(self, path, stems_and_suffixes):
+        with open(path+'letters') as fl:
+            self.letters = fl.read().strip().split()
+        with open(path+'graphemes') as fl:
+            self.graphemes = fl.read().strip().split()
+        self.graphemes_by_lengths = [[g for g in self.graphemes if len(g) == l]
+                                     for l in range(max([len(g) for g in self.graphemes])+1)]
+        self.grapheme_trie = dict() # character -> child node; the '' key holds the grapheme ending at the node
+        for grapheme in self.graphemes:
+            node = self.grapheme_trie
+            for c in grapheme:
+                node = node.setdefault(c, dict())
+            node[''] = grapheme
+        # Vocabulary is sorted by the first letter.
+        self.vocabulary = dict()
+        letters_set = set(self.letters)
+        skipped_words_n = 0
+        with open(path + ('stems' if stems_and_suffixes else 'vocabulary')) as fl:
+            for line in fl:
+                line = line.strip()
+                if [lett for lett in line if not lett in letters_set]:
+                    skipped_words_n += 1
+                    continue
+                index_lett = unidecode(line[0])
+                if not index_lett in self.vocabulary:
+                    self.vocabulary[index_lett] = []
+                self.vocabulary[index_lett].append(line)
+        print('{} vocabulary words skipped (unknown letters present)'.format(skipped_words_n))
+        # Suffixes are saved only as lists of their graphemes.
+        self.suffixes = []
+        if stems_and_suffixes:
+            with open(path + 'suffixes') as fl:
+                for line in fl:
+                    suffix = line.strip()
+                    self.suffixes.append(suffix)
+
+        self.candidate_indices = dict([(index_lett, LevenshteinIndex(words))
+                                       for (index_lett, words) in self.vocabulary.items()])
+        # (words that cannot be decomposed are left out, so decompose raises for them when asked)
+        self.decompositions = dict()
+        self.tokenizations = dict() # of words outside the vocabulary, see tokenize
+        for word in chain(chain.from_iterable(self.vocabulary.values()), self.suffixes):
+            try:
+                self.decompositions[word] = tuple(self.decompose(word))
+            except ValueError:
+                pass
+        self.tokenizations.clear()
+
+    def decompose(self, word):
+        "Get a list of graphemes in the word."
+        if word in self.decompositions:
+            return list(self.decompositions[word])
+        return list(self.tokenize(word))
+
+    def tokenize(self, word):
+        """Split the word into graphemes, taking the longest grapheme matching at each position. The
+        splits are remembered (up to decompositions_cache_size words)."""
+        if word in self.tokenizations:
+            return self.tokenizations[word]
+        if len(self.tokenizations) >= decompositions_cache_size:
+            self.tokenizations.clear()
+        current_pos = 0
+        graphemes = []
+        while current_pos < len(word):
+            node = self.grapheme_trie
+            longest = None
+            for c in word[current_pos:]:
+                if not c in node:
+                    break
+                node = node[c]
+                if '' in node:
+                    longest = node['']
+            if longest is None:
+                raise ValueError('Cannot decompose string {} in word {}'.format(word[current_pos:], word))
+            graphemes.append(longest)
+            current_pos += len(longest)
+        self.tokenizations[word] = tuple(graphemes)
+        return self.tokenizations[word]
+
+def source_signature(path, stems_and_suffixes):
+    "Identify the versions of the source files by their sizes and modification times."
+    file_names = ['letters', 'graphemes', 'stems' if stems_and_suffixes else 'vocabulary']
+    if stems_and_suffixes:
+        file_names.append('suffixes')
+    signature = [compiled_format_version]
+    for file_name in file_names:
+        stat = os.stat(path+file_name)
+        signature.append((file_name, stat.st_size, stat.st_mtime_ns))
+    return signature
+
+def load_language(path, stems_and_suffixes):
+    "Get the language data from the compiled file in path, compiling it when it is missing or outdated."
+    signature = source_signature(path, stems_and_suffixes)
+    try:
+        with open(path+compiled_file_name, 'rb') as fl:
+            if pickle.load(fl) == signature:
+                return pickle.load(fl)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        pass # (missing, cut off, or pickled from classes which have changed since)
+    language = LanguageData(path, stems_and_suffixes)
+    try:
+        # (write to a temporary file first, so concurrent readers never see a partial one)
+        temp_path = '{}{}.{}'.format(path, compiled_file_name, os.getpid())
+        with open(temp_path, 'wb') as fl:
+            pickle.dump(signature, fl)
+            pickle.dump(language, fl, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path+compiled_file_name)
+    except OSError:
+        pass # the language data is still usable, only not kept
+    return language
+
+def source_hash(path, stems_and_suffixes):
+    "Get a hash (hex digest) of the contents of the source files."
+    file_names = ['letters', 'graphemes', 'stems' if stems_and_suffixes else 'vocabulary']
+    if stems_and_suffixes:
+        file_names.append('suffixes')
+    digest = hashlib.sha256()
+    for file_name in file_names:
+        with open(path+file_name, 'rb') as fl:
+            digest.update(file_name.encode() + b'\0' + fl.read() + b'\0')
+    return digest.hexdigest()
+
+source_hashes = dict() # (path, stems_and_suffixes, source signature) -> hash of the files
+
+def cached_source_hash(path, stems_and_suffixes):
+    "Get source_hash, computed again only when the source files change (see source_signature)."
+    key = (path, stems_and_suffixes, repr(source_signature(path, stems_and_suffixes)))
+    if not key in source_hashes:
+        source_hashes[key] = source_hash(path, stems_and_suffixes)
+    return source_hashes[key]
@@ -20,6 +20,8 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 
+import numpy as np
+
 class LevenshteinAutomaton:
     def __init__(self, string, n):
         self.string = string
@@ -81,3 +83,154 @@ def distance_within(s1, s2, max_distance):
     if aut.is_match(state):
         return aut.distance(state)
     return False
+
+class LevenshteinIndex:
+    "A trie of words, searched for words within some edit distance by walking it with a LevenshteinAutomaton."
+
+    def __init__(self, words=()):
+        self.root = dict() # character -> child node; the '' key holds the word ending at the node
+        self.positions = dict() # word -> list of its positions among the added words
+        self.size = 0
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        node = self.root
+        for c in word:
+            node = node.setdefault(c, dict())
+        node[''] = word
+        self.positions.setdefault(word, []).append(self.size)
+        self.size += 1
+
+    def search(self, string, max_distance):
+        """Return a list of (word, distance) for the indexed words within max_distance from string, in the
+        order in which they were added (words added many times are repeated)."""
+        aut = LevenshteinAutomaton(string, max_distance)
+        found = []
+        stack = [(self.root, aut.start())]
+        while stack:
+            node, state = stack.pop()
+            for (c, child) in node.items():
+                if c == '':
+                    continue
+                child_state = aut.step(state, c)
+                if not aut.can_match(child_state):
+                    continue
+                if '' in child and aut.is_match(child_state):
+                    distance = aut.distance(child_state)
+                    found += [(pos, child[''], distance) for pos in self.positions[child['']]]
+                stack.append((child, child_state))
+        found.sort()
+        return [(word, distance) for (pos, word, distance) in found]
+
+def pair_distances(firsts, seconds, max_distance):
+    """Return an array of Levenshtein distances between firsts[i] and seconds[i], capped at max_distance+1.
+    The dynamic programming runs for all pairs at once, with NumPy."""
+    distances = np.zeros(len(firsts), dtype=int)
+    if len(firsts) == 0:
+        return distances
+    len1 = np.array([len(s) for s in firsts])
+    len2 = np.array([len(s) for s in seconds])
+    codes1 = np.full((len(firsts), max(len1.max(), 1)), -1)
+    codes2 = np.full((len(seconds), max(len2.max(), 1)), -2)
+    for (codes, strings) in [(codes1, firsts), (codes2, seconds)]:
+        for (n, s) in enumerate(strings):
+            codes[n, :len(s)] = [ord(c) for c in s]
+    # Rows of the distance table for all pairs; the distance is taken from the row len1, column len2.
+    row = np.tile(np.arange(codes2.shape[1]+1), (len(firsts), 1))
+    pairs = np.arange(len(firsts))
+    distances[len1 == 0] = len2[len1 == 0]
+    for i in range(1, codes1.shape[1]+1):
+        prev_row, row = row, np.empty_like(row)
+        row[:, 0] = i
+        for j in range(1, codes2.shape[1]+1):
+            row[:, j] = np.minimum(np.minimum(prev_row[:, j], row[:, j-1]) + 1,
+                                   prev_row[:, j-1] + (codes1[:, i-1] != codes2[:, j-1]))
+        ending = len1 == i
+        distances[ending] = row[pairs[ending], len2[ending]]
+    return np.minimum(distances, max_distance+1)
+
+class DistanceCache:
+    """Distances of word pairs kept between calls of pair_list_distances (for one max_distance), at most
+    size of them: when there are more, the least recently used ones are dropped (down to eviction_fill
+    of the size, so this is seldom done). Words are numbered, and each pair is kept under a key made of
+    the numbers of its words, in arrays sorted by key, so many pairs are looked up at once with NumPy."""
+
+    eviction_fill = 0.9
+
+    def __init__(self, size, max_distance):
+        self.size = size
+        self.max_distance = max_distance
+        self.word_ns = dict() # word -> number
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.distances = np.zeros(0, dtype=np.int8) # (capped, so small)
+        self.last_uses = np.zeros(0, dtype=np.int64) # lookup numbers
+        self.lookups_n = 0
+
+    def __len__(self):
+        return len(self.keys)
+
+    def pair_keys(self, words, firsts, seconds):
+        "Get the keys of the pairs of words[firsts[n]] and words[seconds[n]] (the same for both orders)."
+        word_ns = np.array([self.word_ns.setdefault(word, len(self.word_ns)) for word in words], dtype=np.int64)
+        firsts, seconds = word_ns[firsts], word_ns[seconds]
+        return (np.minimum(firsts, seconds) << 32) | np.maximum(firsts, seconds)
+
+    def lookup(self, keys):
+        "Get an array of the distances of pairs with the keys (-1 for pairs not kept), marking them as used."
+        self.lookups_n += 1
+        if not len(self.keys):
+            return np.full(len(keys), -1)
+        positions = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        found = self.keys[positions] == keys
+        self.last_uses[positions[found]] = self.lookups_n
+        return np.where(found, self.distances[positions], -1)
+
+    def add(self, keys, distances):
+        "Keep the distances of pairs with the keys (which should not be kept already, nor repeat)."
+        order = np.argsort(keys)
+        positions = np.searchsorted(self.keys, keys[order])
+        self.keys = np.insert(self.keys, positions, keys[order])
+        self.distances = np.insert(self.distances, positions, distances[order])
+        self.last_uses = np.insert(self.last_uses, positions, self.lookups_n)
+        if len(self.keys) > self.size:
+            # (the indices of the pairs kept are sorted back, so the keys stay sorted)
+            dropped_n = len(self.keys) - int(self.size * self.eviction_fill)
+            kept = np.sort(np.argsort(self.last_uses, kind='stable')[dropped_n:])
+            self.keys, self.distances, self.last_uses = self.keys[kept], self.distances[kept], self.last_uses[kept]
+
+def pair_list_distances(words, firsts, seconds, max_distance, cache=None, batch_size=100000):
+    """Return an array of Levenshtein distances between words[firsts[n]] and words[seconds[n]], capped at
+    max_distance+1. With a DistanceCache, only the pairs not kept in it are computed (in batches of
+    batch_size pairs), and then added to it."""
+    if cache is None:
+        distances = np.zeros(len(firsts), dtype=int)
+        for batch_start in range(0, len(firsts), batch_size):
+            batch = slice(batch_start, batch_start+batch_size)
+            distances[batch] = pair_distances([words[n] for n in firsts[batch]], [words[n] for n in seconds[batch]],
+                                              max_distance)
+        return distances
+    if cache.max_distance != max_distance:
+        raise ValueError('the cache keeps distances capped at {}, not {}'.format(cache.max_distance, max_distance))
+    keys = cache.pair_keys(words, firsts, seconds)
+    distances = cache.lookup(keys)
+    missing = np.nonzero(distances < 0)[0]
+    if len(missing):
+        missing_keys, pair_ns, key_ns = np.unique(keys[missing], return_index=True, return_inverse=True)
+        pair_ns = missing[pair_ns]
+        missing_distances = pair_list_distances(words, firsts[pair_ns], seconds[pair_ns], max_distance,
+                                                batch_size=batch_size)
+        distances[missing] = missing_distances[key_ns]
+        cache.add(missing_keys, missing_distances)
+    return distances
+
+def distance_matrix(words, max_distance, cache=None, batch_size=100000):
+    """Return a symmetric matrix of Levenshtein distances between words, capped at max_distance+1 (that is,
+    more than max_distance). Each unordered pair is computed once (in batches of batch_size pairs); a
+    DistanceCache given as cache keeps the distances of pairs between calls."""
+    matrix = np.zeros((len(words), len(words)), dtype=int)
+    firsts, seconds = np.triu_indices(len(words), 1)
+    distances = pair_list_distances(words, firsts, seconds, max_distance, cache, batch_size)
+    matrix[firsts, seconds] = distances
+    matrix[seconds, firsts] = distances
+    return matrix
@@ -0,0 +1,36 @@
+import multiprocessing, resource, sys, time
+
+# Compare building networks of the fixed length (max_text_len) with networks sized to the input
+# (prm dynamic_length). Each network is built in a separate process, so the memory measurements
+# are not mixed up.
+if not (len(sys.argv) >= 2):
+    print('Usage: python3 network_length_benchmark.py LANGUAGE_DATA_PATH [INPUT_LENGTH...]')
+    sys.exit(-1)
+
+def build(language_data_path, dynamic_length, input_len):
+    "Build a reader for an input of the length; returns (build time, neurons, connections, max RSS in MB)."
+    import nest
+    import reading_model
+    reading_model.prm['language_data_path'] = language_data_path
+    reading_model.prm['dynamic_length'] = dynamic_length
+    reading_model.language() # (not counted in the build time)
+    start = time.perf_counter()
+    reading_model.Reader('spikes', reading_model.network_length('x' * input_len))
+    build_time = time.perf_counter() - start
+    neurons_n, connections_n = nest.GetKernelStatus(['network_size', 'num_connections'])
+    return (build_time, neurons_n, connections_n, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+
+if __name__ == '__main__':
+    language_data_path = sys.argv[1]
+    input_lens = [int(arg) for arg in sys.argv[2:]] or [3, 5, 8]
+    context = multiprocessing.get_context('spawn')
+    print('{:>6} {:>8} {:>10} {:>9} {:>12} {:>13}'.format('input', 'network', 'build (s)', 'neurons',
+                                                           'connections', 'max RSS (MB)'))
+    for input_len in input_lens:
+        for dynamic_length in [False, True]:
+            with context.Pool(1) as pool:
+                build_time, neurons_n, connections_n, memory = pool.apply(build, (language_data_path,
+                                                                                  dynamic_length, input_len))
+            print('{:>6} {:>8} {:>10.2f} {:>9} {:>12} {:>13.1f}'.format(
+                input_len, 'dynamic' if dynamic_length else 'fixed', build_time, neurons_n, connections_n,
+                memory))
@@ -1,31 +1,229 @@
-import datetime, os, sys, nest, pylab
+import contextlib, datetime, functools, itertools, os, sys, time, nest
+import numpy as np
+
+readings_file_name = 'readings.npz' # events of the probes, in the readings directory (see write_events)
 
 # NOTE good values of record_from depend on neuron type used; there need be code for ploting for each below
 multimeter_params = { 'withtime': True, 'record_from': ['V_m'] }
 spikedet_params = { 'withgid': True, 'withtime': True }
 
-probes = dict()
+# Which probes record membrane potentials (spikes are always recorded):
+# 'all' - every probe, 'charted' - only probes with always_chart, 'spikes' - none.
+recording_policies = ['all', 'charted', 'spikes']
+voltage_recording = { 'policy': 'all', 'interval': 1.0 } # interval of voltage recording in ms
+
+# Spikes are recorded by one spike detector for each layer (a group of probes), and counted for each probe
+# by looking up the probe of each sender.
+probes = dict() # name -> { 'cells', 'layer', 'slot' (in the layer), 'order', 'multimeter', 'always_chart' }
+layers = dict() # layer name -> see make_layer
+# Multimeters of removed probes, stopped and kept for probes of the same neurons (NEST devices cannot be
+# deleted, so neurons reused for new probes get their multimeters back).
+idle_multimeters = dict() # tuple of neuron ids -> multimeter
+# Times of events are written relative to the start of the reading (the kernel clock is not set back
+# between readings).
+recording_clock = { 'start': 0.0 }
+probe_order = itertools.count() # for telling which probe was inserted first
+
+# Instrumentation: wall times (s) of the phases of readings, in total and in each step (a simulated
+# focus period), and counters of what was made, collected only while enabled.
+instrumentation = { 'enabled': False, 'stats': None }
+no_phase = contextlib.nullcontext()
+
+class ReadingStats:
+    """Phase times and counters. The phases are: network_creation, connection_building (of the scaffold),
+    lexicon (attaching the candidate words' columns, with vocabulary and network_creation inside), connect
+    (nest.Connect of projections, inside the others), probes, reset, drive, weight_updates, simulate,
+    readout (deciding by spike counts, also inside weight_updates) and cache_lookup. Phases inside others
+    count also in their time."""
+
+    def __init__(self):
+        self.phases = dict()
+        self.steps = []
+        self.current_step = None
+        self.counters = dict()
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        if self.current_step is not None:
+            self.current_step[name] = self.current_step.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        return { 'phases': self.phases, 'steps': self.steps, 'counters': self.counters }
+
+class TimedPhase:
+    def __init__(self, stats, name):
+        self.stats, self.name = stats, name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+
+def enable_instrumentation(enabled=True):
+    instrumentation['enabled'] = enabled
+    if enabled and instrumentation['stats'] is None:
+        instrumentation['stats'] = ReadingStats()
+
+def take_stats():
+    "Get the ReadingStats collected so far and start collecting anew (None when not enabled)."
+    stats = instrumentation['stats']
+    instrumentation['stats'] = ReadingStats() if instrumentation['enabled'] else None
+    return stats
+
+def phase(name):
+    "Get a context manager timing the phase (doing nothing when instrumentation is not enabled)."
+    if not instrumentation['enabled']:
+        return no_phase
+    return TimedPhase(instrumentation['stats'], name)
+
+def timed(name):
+    "Make a decorator timing calls of the function as the phase."
+    def decorator(function):
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if not instrumentation['enabled']:
+                return function(*args, **kwargs)
+            with TimedPhase(instrumentation['stats'], name):
+                return function(*args, **kwargs)
+        return timed_function
+    return decorator
+
+def count(name, n=1):
+    "Add n to the counter (when instrumentation is enabled)."
+    if instrumentation['enabled']:
+        counters = instrumentation['stats'].counters
+        counters[name] = counters.get(name, 0) + n
 
-def reset_reporting():
+def begin_step():
+    "Start timing phases also for a new step."
+    if instrumentation['enabled']:
+        stats = instrumentation['stats']
+        stats.current_step = dict()
+        stats.steps.append(stats.current_step)
+
+def end_step():
+    if instrumentation['enabled']:
+        instrumentation['stats'].current_step = None
+
+def reset_reporting(policy='all', interval=1.0):
+    if not policy in recording_policies:
+        raise ValueError('unknown recording policy {}, should be one of {}'.format(policy, recording_policies))
     probes.clear()
+    layers.clear()
+    idle_multimeters.clear()
+    recording_clock['start'] = 0.0
+    voltage_recording['policy'], voltage_recording['interval'] = policy, interval
 
-def insert_probe(place, name, always_chart=True):
+def make_layer():
+    count('devices_created')
+    return { 'spikedet': nest.Create('spike_detector', params=spikedet_params),
+             'connected_cells': set(),
+             'slot_of_cell': dict(), # neuron id -> slot of its probe
+             'slot_lookup': None, # slot_of_cell as an array, made when needed
+             'slots_n': 0,
+             'free_slots': [],
+             'counts': None, # spike counts by slot, for counted_events_n events
+             'counted_events_n': 0 }
+
+def insert_probe(place, name, always_chart=True, layer='default'):
     if name in probes:
         raise KeyError('probe name {} already in use'.format(name))
-    probes[name] = { 'multimeter': nest.Create('multimeter', params=multimeter_params),
-                     'spikedet': nest.Create('spike_detector', params=spikedet_params),
+    if not layer in layers:
+        layers[layer] = make_layer()
+    recording = layers[layer]
+    cells = list(place)
+    if [cell for cell in cells if cell in recording['slot_of_cell']]:
+        raise ValueError('neurons of probe {} are already recorded in layer {}'.format(name, layer))
+    if recording['free_slots']:
+        slot = recording['free_slots'].pop()
+    else:
+        slot = recording['slots_n']
+        recording['slots_n'] += 1
+    for cell in cells:
+        recording['slot_of_cell'][cell] = slot
+    recording['slot_lookup'], recording['counts'] = None, None
+    multimeter = None
+    if voltage_recording['policy'] == 'all' or (voltage_recording['policy'] == 'charted' and always_chart):
+        multimeter = idle_multimeters.pop(tuple(cells), None)
+        if multimeter is not None:
+            nest.SetStatus(multimeter, { 'start': 0.0, 'stop': nest.GetDefaults('multimeter', 'stop'),
+                                         'n_events': 0 })
+        else:
+            multimeter = nest.Create('multimeter', params=dict(multimeter_params, interval=voltage_recording['interval']))
+            nest.Connect(multimeter, place)
+            count('devices_created')
+            count('connections_created', len(cells))
+    probes[name] = { 'cells': cells,
+                     'layer': layer,
+                     'slot': slot,
+                     'order': next(probe_order),
+                     'multimeter': multimeter,
                      'always_chart': always_chart }
-    nest.Connect(probes[name]['multimeter'], place)
-    nest.Connect(place, probes[name]['spikedet'])
+    new_cells = [cell for cell in cells if not cell in recording['connected_cells']]
+    if new_cells:
+        nest.Connect(new_cells, recording['spikedet'])
+        count('connections_created', len(new_cells))
+        recording['connected_cells'].update(new_cells)
+
+def remove_probe(name):
+    "Stop recording and forget a probe (its multimeter is kept for a later probe of the same neurons)."
+    probe = probes.pop(name)
+    if probe['multimeter'] is not None:
+        nest.SetStatus(probe['multimeter'], { 'start': 0.0, 'stop': 0.0 })
+        idle_multimeters[tuple(probe['cells'])] = probe['multimeter']
+    recording = layers[probe['layer']]
+    for cell in probe['cells']:
+        del recording['slot_of_cell'][cell]
+    recording['free_slots'].append(probe['slot'])
+    recording['slot_lookup'], recording['counts'] = None, None
+
+def clear_probe_events(start=0.0):
+    "Discard the events recorded so far by all probes; the events recorded next are of a reading starting at start (ms)."
+    recording_clock['start'] = start
+    nest.SetStatus([recording['spikedet'][0] for recording in layers.values()]
+                   + [probe['multimeter'][0] for probe in probes.values() if probe['multimeter'] is not None],
+                   { 'n_events': 0 })
+    for recording in layers.values():
+        recording['counts'] = None
+
+def layer_spike_counts(layer):
+    "Get the spike counts of a layer's probes, indexed by slots."
+    recording = layers[layer]
+    events_n = nest.GetStatus(recording['spikedet'], 'n_events')[0]
+    if recording['counts'] is not None and recording['counted_events_n'] == events_n:
+        return recording['counts']
+    if recording['slot_lookup'] is None:
+        lookup = np.full(max(recording['connected_cells'], default=0)+1, -1, dtype=int)
+        lookup[list(recording['slot_of_cell'].keys())] = list(recording['slot_of_cell'].values())
+        recording['slot_lookup'] = lookup
+    senders = np.asarray(nest.GetStatus(recording['spikedet'], 'events')[0]['senders'], dtype=int)
+    slots = recording['slot_lookup'][senders]
+    recording['counts'] = np.bincount(slots[slots >= 0], minlength=recording['slots_n'])
+    recording['counted_events_n'] = events_n
+    return recording['counts']
+
+def probe_spike_events(name):
+    "Get (times, senders) arrays of spikes recorded by the probe."
+    probe = probes[name]
+    events = nest.GetStatus(layers[probe['layer']]['spikedet'], 'events')[0]
+    own = np.isin(events['senders'], probe['cells'])
+    return (np.asarray(events['times'])[own], np.asarray(events['senders'])[own])
 
 def score_spikes(names):
     "Return a sorted list of (spike counts, names) for a list of names registered for reporting."
-    contest_probes = [(len(nest.GetStatus(probe['spikedet'], 'events')[0]['times']), name)
-                      for (name, probe) in probes.items()
-                      if name in names]
+    registered = sorted(set([name for name in names if name in probes]), key=lambda name: probes[name]['order'])
+    layer_counts = dict()
+    contest_probes = []
+    for name in registered:
+        layer = probes[name]['layer']
+        if not layer in layer_counts:
+            layer_counts[layer] = layer_spike_counts(layer)
+        contest_probes.append((int(layer_counts[layer][probes[name]['slot']]), name))
     contest_probes.sort(key=lambda x: x[0], reverse=True)
     return contest_probes
 
+@timed('readout')
 def decide_spikes(name_groups):
     "Given a list of lists of names registered for reporting, for each list (group) return a list of pairs (name, spike count) with most spikes."
     decisions = []
@@ -34,40 +232,77 @@ def decide_spikes(name_groups):
         decisions.append((group_probes[0][1], group_probes[0][0]))
     return decisions
 
-def write_readings(path, params=None, spike_groups=dict(), spike_decisions=dict(), thorough=True):
+def make_readings_dir(path):
+    "Create a directory for readings, with a timestamp added to the path, and return its path."
     path += datetime.datetime.now().strftime('_%d-%m-%Y_%H-%M-%S')+'/' # add a timestamp
     os.makedirs(path, exist_ok=False) # throw an exception if exists
-    for (name, probe) in probes.items():
-        if not thorough and not probe['always_chart']:
-            continue
-        multim_events = nest.GetStatus(probe['multimeter'], 'events')[0]
-        fig = pylab.figure()
-        pylab.plot(multim_events['times'], multim_events['V_m'])
-        pylab.ticklabel_format(useOffset=False, style='plain') # disable offsets and scientific notation
-        pylab.savefig(path+name+'_membrane_potential.png')
-        pylab.close(fig)
-
-        spikedet_events = nest.GetStatus(probe['spikedet'], 'events')[0]
-        fig = pylab.figure()
-        pylab.plot(spikedet_events['times'], spikedet_events['senders'], '.')
-        pylab.ticklabel_format(useOffset=False, style='plain')
-        pylab.savefig(path+name+'_spikes.png')
-        pylab.close(fig)
+    return path
+
+def write_spike_scores(path, label, contest_probes, registered_n):
+    "Write the spike scores (see score_spikes) of a group of registered_n names."
+    with open(path+label+'_spike_scores.txt', 'w+') as spike_group_file:
+        print('# {} ({} registered)'.format(label, registered_n), file=spike_group_file)
+        for (spike_count, name) in contest_probes:
+            print('{:>7} : {}'.format(spike_count, name), file=spike_group_file)
+
+def write_spike_decision(path, label, decisions):
+    "Write the decisions (see decide_spikes) of groups."
+    with open(path+label+'_spike_decision.txt', 'w+') as spike_decision_file:
+        for dec in decisions:
+            print(dec[1], dec[0], file=spike_decision_file)
+
+def write_params(path, params):
+    with open(path+'_params.txt', 'w+') as params_file:
+        for (param, val) in params.items():
+            print('{} : {}'.format(param, val), file=params_file)
+
+def concatenated(arrays, dtype):
+    return np.concatenate([np.asarray(array, dtype=dtype) for array in arrays]) if arrays else np.zeros(0, dtype=dtype)
+
+def write_events(path, thorough=True):
+    """Write the spikes and membrane potentials recorded by all probes to one compressed file, with
+    tables of the probes' neurons (see render_readings.py, which charts them). Probes are marked to be
+    charted if they are always charted or the readings are thorough."""
+    names = list(probes)
+    name_ns = dict([(name, name_n) for (name_n, name) in enumerate(names)])
+    layer_names = list(layers)
+    # (all the devices are asked for their events at once)
+    layer_events = (nest.GetStatus([layers[layer]['spikedet'][0] for layer in layer_names], 'events')
+                    if layer_names else [])
+    voltage_names = [name for name in names if probes[name]['multimeter'] is not None]
+    voltage_events = (nest.GetStatus([probes[name]['multimeter'][0] for name in voltage_names], 'events')
+                      if voltage_names else [])
+    np.savez_compressed(path+readings_file_name,
+                        probe_names=np.array(names, dtype=str),
+                        probe_layers=np.array([layer_names.index(probes[name]['layer']) for name in names], dtype=int),
+                        probe_charted=np.array([thorough or probes[name]['always_chart'] for name in names], dtype=bool),
+                        # The neurons of probe n are probe_cells[probe_cells_start[n]:probe_cells_start[n+1]].
+                        probe_cells=concatenated([probes[name]['cells'] for name in names], int),
+                        probe_cells_start=np.cumsum([0] + [len(probes[name]['cells']) for name in names], dtype=int),
+                        layer_names=np.array(layer_names, dtype=str),
+                        spike_layers=concatenated([np.full(len(events['senders']), layer_n)
+                                                   for (layer_n, events) in enumerate(layer_events)], int),
+                        spike_senders=concatenated([events['senders'] for events in layer_events], int),
+                        spike_times=concatenated([events['times'] for events in layer_events], float)
+                            - recording_clock['start'],
+                        voltage_probes=concatenated([np.full(len(events['times']), name_ns[name])
+                                                     for (name, events) in zip(voltage_names, voltage_events)], int),
+                        voltage_times=concatenated([events['times'] for events in voltage_events], float)
+                            - recording_clock['start'],
+                        voltage_values=concatenated([events['V_m'] for events in voltage_events], float))
+
+def write_readings(path, params=None, spike_groups=dict(), spike_decisions=dict(), thorough=True):
+    """Write the recorded events (see write_events), spike scores, decisions and params to a new
+    directory for the readings, returning its path."""
+    path = make_readings_dir(path)
+    write_events(path, thorough)
 
     for (label, names) in spike_groups.items():
-        with open(path+label+'_spike_scores.txt', 'w+') as spike_group_file:
-            contest_probes = score_spikes(names)
-            print('# {} ({} registered)'.format(label, len(names)), file=spike_group_file)
-            for (spike_count, name) in contest_probes:
-                print('{:>7} : {}'.format(spike_count, name), file=spike_group_file)
+        write_spike_scores(path, label, score_spikes(names), len(names))
 
     for (label, groups) in spike_decisions.items():
-        with open(path+label+'_spike_decision.txt', 'w+') as spike_decision_file:
-            decisions = decide_spikes(groups)
-            for dec in decisions:
-                print(dec[1], dec[0], file=spike_decision_file)
+        write_spike_decision(path, label, decide_spikes(groups))
 
     if params is not None:
-        with open(path+'_params.txt', 'w+') as params_file:
-            for (param, val) in params.items():
-                print('{} : {}'.format(param, val), file=params_file)
+        write_params(path, params)
+    return path
@@ -0,0 +1,147 @@
+import collections, functools, itertools, multiprocessing
+import reading_cache, reading_model
+
+# Reading word lists with a pool of worker processes, each with its own NEST kernel (and Reader).
+# Every reading starts from the same kernel state (see reading_model.Reader), so the results do not
+# depend on how the words are spread over the workers: they are the same as in a serial run, as long
+# as the number of NEST threads (which decides the random streams) is the same (except with prm
+# incremental_lexicon, where a reading depends on the words the worker read before it). With prm
+# dynamic_length, words with the same network length should be given together (see length_order), as
+# a worker builds its reader anew when the length changes.
+
+worker_state = dict()
+
+def changed_params(base, params):
+    """Get a copy of the base prm changed by params. A name with a dot, like 'letter_head_excitation.weight',
+    changes a key in a dict parameter."""
+    changed = dict(base)
+    for (name, value) in params.items():
+        if '.' in name:
+            name, key = name.split('.', 1)
+            changed[name] = dict(changed[name], **{ key: value })
+        else:
+            changed[name] = value
+    return changed
+
+def length_order(words, params=None):
+    """Get the numbers of the words ordered by their network lengths (see reading_model.network_length)
+    with prm changed by params, keeping the order of words of the same length."""
+    length_prm = changed_params(reading_model.prm, params or dict())
+    return sorted(range(len(words)), key=lambda word_n: reading_model.network_length(words[word_n], length_prm))
+
+def set_params(params):
+    "Replace the contents of prm (keeping the dict, which the weight functions refer to)."
+    reading_model.prm.clear()
+    reading_model.prm.update(params)
+
+def init_worker(params):
+    "Prepare a worker to read words, with prm changed by params (plain values, to be sent to processes)."
+    set_params(changed_params(reading_model.prm, params))
+    worker_state['base_prm'] = dict(reading_model.prm)
+    worker_state['params'] = dict()
+    worker_state['reader'] = None # made for the first word (see reading_model.reader_for)
+    worker_state['batch_reader'] = None # made for the first batch (see reading_model.batch_reader_for)
+
+def read_case_entry(word):
+    """Read the word in a worker, or take its reading from the cache (see reading_cache); returns the
+    cache entry, None for inputs the model cannot read."""
+    entry, worker_state['reader'] = reading_cache.cached_reading(word, reader=worker_state['reader'])
+    return entry
+
+def read_case(word):
+    "Read the word in a worker; returns None for inputs the model cannot read."
+    entry = read_case_entry(word)
+    return None if entry is None else entry['reading']
+
+def read_case_with(params, word):
+    """Read the word in a worker (see read_case) with prm changed by params, on top of the ones given
+    to init_worker. The reader is built anew when the params change."""
+    if params != worker_state['params']:
+        set_params(changed_params(worker_state['base_prm'], params))
+        worker_state['params'] = dict(params)
+        worker_state['reader'] = None
+        worker_state['batch_reader'] = None
+    return read_case(word)
+
+def read_case_timed(word):
+    """Read the word in a worker (see read_case), returning the reading with the instrumentation stats
+    (see neuro_reporting.ReadingStats) of the reading, as a dict."""
+    reading_model.enable_instrumentation()
+    reading_model.take_stats() # (what was before the word)
+    reading = read_case(word)
+    return (reading, reading_model.take_stats().as_dict())
+
+def warm_up_worker(params):
+    "Prepare a worker (see init_worker) and build its reader already, before the first word comes."
+    init_worker(params)
+    worker_state['reader'] = reading_model.reader_for('')
+
+def read_case_scored(word, with_scores=False):
+    """Read the word in a worker, returning a dict with the reading (None for inputs the model cannot
+    read) and, if asked for, the spike scores of the reading's spike groups and decisions."""
+    entry = read_case_entry(word)
+    result = { 'reading': None if entry is None else entry['reading'] }
+    if with_scores and entry is not None:
+        result['scores'] = dict([(label, [(name, count) for (count, name) in scores])
+                                 for (label, scores) in entry['scores'].items()])
+        result['decisions'] = entry['decisions']
+    return result
+
+def read_batch(words):
+    """Read the words in a worker as one batch of circuits simulated together (see
+    reading_model.BatchReader). The circuits are kept for the next batches."""
+    entries, worker_state['batch_reader'] = reading_cache.cached_batch_readings(
+        words, batch_size=len(words), batch_reader=worker_state['batch_reader'])
+    return [None if entry is None else entry['reading'] for entry in entries]
+
+def read_tagged(task, item):
+    "Run the task on the word of a (tag, word) item in a worker, returning (tag, result)."
+    tag, word = item
+    return (tag, task(word))
+
+def read_tagged_batch(items):
+    "Read the words of (tag, word) items as one batch (see read_batch), returning a list of (tag, reading)."
+    return list(zip([tag for (tag, word) in items], read_batch([word for (tag, word) in items])))
+
+def run_tasks(task, items, workers, params, chunksize):
+    """Run the task (read_case or read_batch) on the items in workers, yielding the results in order.
+    The items are taken from the iterable in windows of a few chunks for each worker, with at most two
+    windows given to the pool at a time, so a long (or endless) iterable is not drained at once."""
+    if workers == 1:
+        init_worker(params)
+        for item in items:
+            yield task(item)
+        return
+    items = iter(items)
+    windows = iter(lambda: list(itertools.islice(items, 4 * workers * chunksize)), [])
+    context = multiprocessing.get_context('spawn') # (NEST kernels don't survive forking)
+    with context.Pool(workers, initializer=init_worker, initargs=(params,)) as pool:
+        window_results = collections.deque()
+        for window in windows:
+            window_results.append(pool.imap(task, window, chunksize))
+            if len(window_results) > 1:
+                yield from window_results.popleft()
+        while window_results:
+            yield from window_results.popleft()
+
+def read_words(words, workers=1, params=None, chunksize=1, batch_size=None, with_stats=False, tagged=False):
+    """Read the words (any iterable), yielding their readings (see read_case) in the order of words as
+    soon as they are ready. With one worker, the reading is done in the current process. With a batch
+    size, each task is a batch of words read together (see read_batch); the readings are then the ones
+    of single reading with prm pregenerated_drive, not with the default Poisson drive. With stats, pairs
+    of readings and their instrumentation stats are yielded (see read_case_timed; not available for
+    batches). If tagged, the words are given as (tag, word) pairs, and (tag, reading) pairs are
+    yielded, with the tags (any picklable values) passed through the workers."""
+    params = params or dict()
+    if batch_size is None:
+        task = read_case_timed if with_stats else read_case
+        if tagged:
+            task = functools.partial(read_tagged, task)
+        yield from run_tasks(task, words, workers, params, chunksize)
+        return
+    if with_stats:
+        raise ValueError('instrumentation stats are not available for batch reading')
+    words = iter(words)
+    batches = iter(lambda: list(itertools.islice(words, batch_size)), [])
+    for readings in run_tasks(read_tagged_batch if tagged else read_batch, batches, workers, params, chunksize):
+        yield from readings
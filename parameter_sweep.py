@@ -0,0 +1,195 @@
+import argparse, concurrent.futures, csv, itertools, json, multiprocessing, random
+import parallel_reading, reading_model
+
+# Sweeping model parameters: each configuration (a set of prm changes) is scored by its accuracy on the
+# cases, with (configuration, word) jobs read by a pool of worker processes. Configurations which cannot
+# beat the best one finished so far are pruned: always when they would not beat it even if all their
+# remaining cases were read right, and (with a pruning margin) when their accuracy on at least the
+# sample of cases is below the best one by more than the margin. All configurations read the cases in
+# the same (shuffled) order, so the first cases read are a random sample.
+#
+# The search space is a JSON object mapping prm names (see parallel_reading.changed_params for names of
+# keys in dict parameters) to lists of values, or to ranges: { "min": ..., "max": ..., "steps": ... }
+# (steps are needed only for the grid). Values from ranges of integer parameters (like column sizes)
+# are rounded.
+
+def integer_param(name):
+    "Tell whether the value of the prm name (possibly with a dot) is an integer in the default prm."
+    value = reading_model.prm
+    for key in name.split('.'):
+        if not isinstance(value, dict) or not key in value:
+            return False
+        value = value[key]
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def range_values(spec, integer=False):
+    "Get the evenly spaced values of a range with steps (rounded and without repeats if integer)."
+    if spec['steps'] == 1:
+        values = [spec['min']]
+    else:
+        values = [spec['min'] + (spec['max'] - spec['min']) * step_n / (spec['steps'] - 1)
+                  for step_n in range(spec['steps'])]
+    if integer:
+        values = sorted(set([int(round(value)) for value in values]))
+    return values
+
+def grid_configs(space):
+    "Get all combinations of the values in the space, as dicts of params."
+    names = sorted(space)
+    values = [range_values(space[name], integer_param(name)) if isinstance(space[name], dict) else space[name]
+              for name in names]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+def random_value(spec, integer, rng):
+    "Draw a value uniformly from a list or a range (an integer one if integer)."
+    if not isinstance(spec, dict):
+        return rng.choice(spec)
+    if integer:
+        return rng.randint(int(round(spec['min'])), int(round(spec['max'])))
+    return rng.uniform(spec['min'], spec['max'])
+
+def random_configs(space, configs_n, rng):
+    "Get configurations with values drawn from the space (uniformly from lists and ranges)."
+    names = sorted(space)
+    return [dict([(name, random_value(space[name], integer_param(name), rng)) for name in names])
+            for config_n in range(configs_n)]
+
+class ConfigScore:
+    "Incremental score of a configuration."
+
+    def __init__(self, config_n, params, cases_n):
+        self.config_n = config_n
+        self.params = params
+        self.cases_n = cases_n
+        self.submitted_n = 0
+        self.read_n = 0
+        self.good = 0
+        self.status = 'running' # or 'done', 'pruned'
+
+    def accuracy(self):
+        return self.good / self.read_n if self.read_n else 0.0
+
+    def add(self, good):
+        self.read_n += 1
+        self.good += int(good)
+        if self.read_n == self.cases_n:
+            self.status = 'done'
+
+    def should_prune(self, best, sample_n, prune_margin):
+        "Tell whether the configuration cannot beat the best (finished) one."
+        if best is None or self.status != 'running':
+            return False
+        if self.good + (self.cases_n - self.read_n) <= best.good:
+            return True
+        return (prune_margin is not None and self.read_n >= sample_n
+                and self.accuracy() < best.accuracy() - prune_margin)
+
+def sweep(cases, configs, workers=1, base_params=None, sample_n=50, prune_margin=None, seed=0,
+          on_finished=None):
+    """Score the configurations on the cases (pairs of word, expected form), returning their ConfigScores.
+    Each score is passed to on_finished (if given) when its configuration is done or pruned."""
+    case_order = list(range(len(cases)))
+    random.Random(seed).shuffle(case_order)
+    scores = [ConfigScore(config_n, params, len(cases)) for (config_n, params) in enumerate(configs)]
+    best = None
+    pending = dict() # future -> (ConfigScore, case number)
+
+    def jobs():
+        for score in scores:
+            for case_n in case_order:
+                if score.status != 'running':
+                    break
+                yield (score, case_n)
+
+    def finish(score):
+        for (future, (pending_score, case_n)) in list(pending.items()):
+            if pending_score is score:
+                future.cancel()
+        if on_finished is not None:
+            on_finished(score)
+
+    context = multiprocessing.get_context('spawn') # (NEST kernels don't survive forking)
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=context,
+                                                initializer=parallel_reading.init_worker,
+                                                initargs=(base_params or dict(),)) as pool:
+        job_iter = jobs()
+        jobs_left = True
+        while jobs_left or pending:
+            # Keep the workers busy with a few jobs each, submitting them in the order of
+            # configurations, so workers seldom have to rebuild their readers.
+            while jobs_left and len(pending) < 2 * workers:
+                job = next(job_iter, None)
+                if job is None:
+                    jobs_left = False
+                    break
+                score, case_n = job
+                future = pool.submit(parallel_reading.read_case_with, score.params, cases[case_n][0])
+                pending[future] = (score, case_n)
+                score.submitted_n += 1
+            if not pending:
+                break
+            done, not_done = concurrent.futures.wait(list(pending), return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                score, case_n = pending.pop(future)
+                if future.cancelled() or score.status != 'running':
+                    continue
+                score.add(future.result() == cases[case_n][1])
+                if score.status == 'done':
+                    if best is None or score.good > best.good:
+                        best = score
+                    finish(score)
+            for score in scores:
+                if score.should_prune(best, sample_n, prune_margin):
+                    score.status = 'pruned'
+                    finish(score)
+    return scores
+
+argparser = argparse.ArgumentParser(description='Score configurations of model parameters by the accuracy of'
+                                                ' reading the cases from a CSV file (word, expected form).')
+argparser.add_argument('cases_path', metavar='FILE_WITH_CASES')
+argparser.add_argument('space_path', metavar='SPACE_FILE', help='JSON file with the search space')
+argparser.add_argument('--random', type=int, metavar='N',
+                       help='score N random configurations from the space (default: the whole grid)')
+argparser.add_argument('--workers', type=int, default=1, help='number of worker processes (default 1)')
+argparser.add_argument('--threads', type=int, help='NEST threads in each worker (default from prm)')
+argparser.add_argument('--sample', type=int, default=50,
+                       help='cases read before a configuration can be pruned by the margin (default 50)')
+argparser.add_argument('--prune-margin', type=float,
+                       help='prune configurations with accuracy on the sample below the best one by more than this'
+                            ' (default: prune only those which cannot beat the best one)')
+argparser.add_argument('--seed', type=int, default=0, help='seed for the case order and random configurations')
+argparser.add_argument('--output', default='sweep.tsv', help='table of results (default sweep.tsv)')
+
+if __name__ == '__main__': # (worker processes import this file too)
+    args = argparser.parse_args()
+
+    with open(args.cases_path) as fl:
+        cases = [row[:2] for row in csv.reader(fl) if row]
+    with open(args.space_path) as fl:
+        space = json.load(fl)
+    if args.random is not None:
+        configs = random_configs(space, args.random, random.Random(args.seed))
+    else:
+        configs = grid_configs(space)
+
+    base_params = { 'recording_policy': 'spikes' } # (membrane potentials are not used here)
+    if args.threads is not None:
+        base_params['local_num_threads'] = args.threads
+
+    names = sorted(space)
+    with open(args.output, 'w') as output_file:
+        table = csv.writer(output_file, delimiter='\t')
+        table.writerow(['config', 'status', 'read', 'good', 'accuracy'] + names)
+        def on_finished(score):
+            table.writerow([score.config_n, score.status, score.read_n, score.good, '{:.4f}'.format(score.accuracy())]
+                           + [score.params[name] for name in names])
+            output_file.flush()
+            print('{} {} {}/{}'.format(score.config_n, score.status, score.good, score.read_n), flush=True)
+        scores = sweep(cases, configs, args.workers, base_params, args.sample, args.prune_margin, args.seed,
+                       on_finished)
+
+    done = [score for score in scores if score.status == 'done']
+    if done:
+        best = max(done, key=lambda score: score.good)
+        print('best', best.config_n, best.params, 'accuracy', best.accuracy())
+    print('{} configurations done, {} pruned'.format(len(done), len(scores) - len(done)))
@@ -1,18 +1,32 @@
 import sys # import the model/nest later, so it won't display its startup message if we fail on config
 
 # Parse command line args.
-if not (len(sys.argv) in [2, 3]):
-    print('Usage: read_word.py TEXT_INPUT [EXPERIMENT_NAME]')
+args = sys.argv[1:]
+bypass_cache = '--no-cache' in args
+if bypass_cache:
+    args.remove('--no-cache')
+if not (len(args) in [1, 2]):
+    print('Usage: read_word.py [--no-cache] TEXT_INPUT [EXPERIMENT_NAME]')
     sys.exit(-1)
-net_text_input = sys.argv[1]
+net_text_input = args[0]
 
 experiment_name = 'experim'
-if len(sys.argv) == 3:
-    experiment_name = sys.argv[2]
+if len(args) == 2:
+    experiment_name = args[1]
 word_simulation_name = experiment_name + '_' + net_text_input
 
-from reading_model import simulate_reading, save_readings, word_read
+from reading_model import prm, save_readings
+from reading_cache import cached_reading, save_cached_readings
+from render_readings import render_readings
 
-simulate_reading(net_text_input)
-print(word_read())
-save_readings(word_simulation_name, thorough=False)
+prm['reading_cache_bypass'] = bypass_cache
+# (the readings are not saved thoroughly)
+entry, reader = cached_reading(net_text_input, recording_policy='charted')
+if entry is None:
+    print('Cannot read {} with this model'.format(net_text_input))
+    sys.exit(-1)
+print(entry['reading'])
+if reader is None: # the reading was cached, so there is no simulation to plot
+    save_cached_readings(word_simulation_name, entry)
+else:
+    render_readings(save_readings(word_simulation_name, thorough=False))
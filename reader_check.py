@@ -0,0 +1,43 @@
+import argparse, csv, sys
+
+# Check that reading with a reused network gives the same readings as networks built from nothing (see
+# reading_model.Reader and compare_with_fresh_build), and optionally that batch reading gives the same
+# readings as single reading with the pregenerated drive (see compare_batch_with_single). Exits with
+# status 1 if any reading differs.
+
+argparser = argparse.ArgumentParser(description='Check that reused networks read the words as fresh ones do.')
+argparser.add_argument('words', metavar='WORD', nargs='*', help='words to read')
+argparser.add_argument('--cases', metavar='FILE_WITH_CASES',
+                       help='read also the words of a CSV file with cases (word, expected form)')
+argparser.add_argument('--batch-size', type=int,
+                       help='check also batch reading with batches of this size')
+argparser.add_argument('--threads', type=int, help='NEST threads (default from prm)')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    words = list(args.words)
+    if args.cases is not None:
+        with open(args.cases) as fl:
+            words += [row[0] for row in csv.reader(fl) if row]
+    if not words:
+        argparser.error('no words given')
+
+    import reading_model
+    reading_model.prm['recording_policy'] = 'spikes'
+    reading_model.prm['reading_cache_bypass'] = True
+    if args.threads is not None:
+        reading_model.prm['local_num_threads'] = args.threads
+
+    differences_n = 0
+    for (word, fresh_reading, reading) in reading_model.compare_with_fresh_build(words):
+        if fresh_reading[0] != reading[0]:
+            print('{}: fresh build read {}, reused one {}'.format(word, fresh_reading[0], reading[0]))
+        else:
+            print('{}: read {} by both, with different spike counts'.format(word, reading[0]))
+        differences_n += 1
+    if args.batch_size is not None:
+        for (word, single_reading, batch_reading) in reading_model.compare_batch_with_single(words, args.batch_size):
+            print('{}: single reading {}, batch reading {}'.format(word, single_reading, batch_reading))
+            differences_n += 1
+    print('{} words checked, {} differences'.format(len(words), differences_n))
+    sys.exit(1 if differences_n else 0)
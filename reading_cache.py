@@ -0,0 +1,187 @@
+import hashlib, os, pickle, nest
+import reading_model
+from reading_model import prm
+from language_data import cached_source_hash
+from neuro_reporting import make_readings_dir, write_spike_scores, write_spike_decision, write_params, timed, count
+
+# Readings kept on disk, one pickled entry in a file for each key. The key covers everything a reading
+# depends on: the input, the model parameters (with weight functions evaluated), the contents of the
+# language data files, the random seeds (which are parameters), the model code (see code_hash) and the
+# NEST version. Entries are evicted least recently used first (reading an entry updates its file's
+# modification time), when the number of entries (counted by each process at its first store and then
+# tracked) exceeds the cache size. Readings with prm incremental_lexicon depend on the inputs read
+# before them, so they are neither looked up nor stored.
+# Sources of the simulation, and of this module (which makes the entries).
+code_file_names = ['reading_model.py', 'connectivity.py', 'connectivity_templates.py', 'neuro_reporting.py',
+                   'language_data.py', 'levenshtein.py', 'reading_cache.py']
+code_hashes = [] # (computed once in a process)
+# Parameters which don't change the readings, and are left out of the key.
+neutral_params = ['readings_path', 'language_data_path', 'recording_policy', 'recording_interval',
+                  'word_distances_cache_size', 'reading_batch_size', 'reading_cache_path',
+                  'reading_cache_size', 'reading_cache_bypass']
+eviction_fill = 0.9 # part of the cache size left filled after evicting
+
+entries_counts = dict() # cache path -> number of entries (as seen by this process)
+
+def canonical_params(overrides=None):
+    """Get the parameters which affect the readings as a sorted tuple of (name, value) pairs. Functions
+    of length are replaced by their values for lengths up to twice max_text_len."""
+    params = dict(prm, **(overrides or dict()))
+    canonical = []
+    for (name, value) in sorted(params.items()):
+        if name in neutral_params:
+            continue
+        if callable(value):
+            value = [value(length) for length in range(1, 2 * params['max_text_len'] + 1)]
+        canonical.append((name, repr(value)))
+    return tuple(canonical)
+
+def code_hash():
+    "Get a hash (hex digest) of the contents of the code files."
+    if not code_hashes:
+        digest = hashlib.sha256()
+        code_path = os.path.dirname(os.path.abspath(__file__))
+        for file_name in code_file_names:
+            with open(os.path.join(code_path, file_name), 'rb') as fl:
+                digest.update(file_name.encode() + b'\0' + fl.read() + b'\0')
+        code_hashes.append(digest.hexdigest())
+    return code_hashes[0]
+
+def cache_key(net_text_input, overrides=None):
+    "Get the key (hex digest) of the reading of the input with the current prm changed by overrides."
+    contents = repr((code_hash(), nest.version(), net_text_input, canonical_params(overrides),
+                     cached_source_hash(prm['language_data_path'], prm['stems_and_suffixes'])))
+    return hashlib.sha256(contents.encode()).hexdigest()
+
+def reading_entry(reading, spike_counts, spike_groups, probe_prefix=''):
+    """Make a cache entry from a reading and its spike counts (see reading_model.spike_counts): a dict
+    with the reading, the decisions ({ label: [(name, spike count)] }), the spike scores
+    ({ label: [(spike count, name)] }) and the numbers of names registered in spike groups, with names
+    stripped of the probe prefix."""
+    strip = lambda name: name[len(probe_prefix):]
+    decisions, scores = spike_counts
+    return { 'reading': reading,
+             'decisions': dict([(label, [(strip(name), count) for (name, count) in label_decisions])
+                                for (label, label_decisions) in decisions.items()]),
+             'scores': dict([(label, [(count, strip(name)) for (count, name) in label_scores])
+                             for (label, label_scores) in scores.items()]),
+             'registered': dict([(label, len(names)) for (label, names) in spike_groups.items()]) }
+
+def current_entry():
+    "Make a cache entry from the last reading of the module's Reader (see reading_model.word_read)."
+    return reading_entry(reading_model.word_read(),
+                         reading_model.spike_counts(reading_model.spike_groups, reading_model.spike_decisions),
+                         reading_model.spike_groups)
+
+def entry_path(key):
+    return '{}{}/{}.pickle'.format(prm['reading_cache_path'], key[:2], key)
+
+@timed('cache_lookup')
+def lookup(key):
+    "Get the cached entry for the key, or None."
+    if prm['reading_cache_bypass'] or prm['incremental_lexicon']:
+        return None
+    try:
+        with open(entry_path(key), 'rb') as fl:
+            entry = pickle.load(fl)
+        os.utime(entry_path(key)) # (used recently)
+        count('cache_hits')
+        return entry
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+def store(key, entry):
+    "Keep the entry for the key, evicting the least recently used entries when the cache is too large."
+    if prm['reading_cache_bypass'] or prm['incremental_lexicon']:
+        return
+    cache_path = prm['reading_cache_path']
+    if not cache_path in entries_counts:
+        entries_counts[cache_path] = len(cache_files(cache_path))
+    try:
+        new = not os.path.exists(entry_path(key))
+        os.makedirs(os.path.dirname(entry_path(key)), exist_ok=True)
+        # (write to a temporary file first, so concurrent readers never see a partial one)
+        temp_path = '{}.{}'.format(entry_path(key), os.getpid())
+        with open(temp_path, 'wb') as fl:
+            pickle.dump(entry, fl, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, entry_path(key))
+    except OSError:
+        return # the reading is still usable, only not kept
+    if new:
+        entries_counts[cache_path] += 1
+    if entries_counts[cache_path] > prm['reading_cache_size']:
+        entries_counts[cache_path] = evict()
+
+def cache_files(cache_path):
+    "Get a list of (modification time, path) of the entry files in the cache."
+    entries = []
+    for (dir_path, dir_names, file_names) in os.walk(cache_path):
+        for file_name in file_names:
+            if file_name.endswith('.pickle'):
+                try:
+                    path = os.path.join(dir_path, file_name)
+                    entries.append((os.stat(path).st_mtime_ns, path))
+                except OSError:
+                    pass # (evicted by another process)
+    return entries
+
+def evict():
+    """Remove the least recently used entries, leaving eviction_fill of the cache size (so the cache is
+    walked only once in a while). Returns the number of entries left."""
+    entries = sorted(cache_files(prm['reading_cache_path']))
+    kept_n = min(len(entries), int(prm['reading_cache_size'] * eviction_fill))
+    for (mtime, path) in entries[:len(entries) - kept_n]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return kept_n
+
+def cached_reading(net_text_input, recording_policy=None, reader=None):
+    """Get the cache entry (see reading_entry) of the input's reading, simulating the reading with the
+    reader (see reading_model.reader_for) only if it is not cached. Returns (entry, reader), where the
+    reader is the one to pass for the next input; the entry is None if the model cannot read the input."""
+    key = cache_key(net_text_input)
+    entry = lookup(key)
+    if entry is not None:
+        return (entry, reader)
+    reader = reading_model.reader_for(net_text_input, reader, recording_policy)
+    try:
+        reader.read(net_text_input)
+    except ValueError:
+        return (None, reader)
+    entry = current_entry()
+    store(key, entry)
+    return (entry, reader)
+
+def cached_batch_readings(net_text_inputs, batch_size=None, batch_reader=None):
+    """Get the cache entries of the inputs' readings with batch reading (see
+    reading_model.simulate_reading_batch), simulating only the inputs not cached, with the batch reader
+    if it fits. Returns (entries, batch reader), where the batch reader is the one to pass for the next
+    inputs; the entries are None for inputs the model cannot read."""
+    # (batch readings are the same as single readings with the pregenerated drive)
+    keys = [cache_key(net_text_input, { 'pregenerated_drive': True }) for net_text_input in net_text_inputs]
+    entries = [lookup(key) for key in keys]
+    missing_ns = [input_n for (input_n, entry) in enumerate(entries) if entry is None]
+    def collect(batch_input_n, reader):
+        if reader.reading is None:
+            return
+        input_n = missing_ns[batch_input_n]
+        entries[input_n] = reading_entry(reader.reading, reader.final_spike_counts, reader.spike_groups,
+                                         reader.probe_prefix)
+        store(keys[input_n], entries[input_n])
+    if missing_ns:
+        batch_reader = reading_model.simulate_reading_batch([net_text_inputs[input_n] for input_n in missing_ns],
+                                                            batch_size, collect=collect,
+                                                            batch_reader=batch_reader)[1]
+    return (entries, batch_reader)
+
+def save_cached_readings(simulation_name, entry):
+    """Write the spike scores and decisions of a cached reading, as save_readings writes them (there are
+    no plots without the simulation)."""
+    path = make_readings_dir(prm['readings_path']+simulation_name)
+    for (label, scores) in entry['scores'].items():
+        write_spike_scores(path, label, scores, entry['registered'][label])
+    for (label, decisions) in entry['decisions'].items():
+        write_spike_decision(path, label, decisions)
+    write_params(path, prm)
@@ -1,35 +1,30 @@
 from itertools import chain
+import numpy as np
 from scipy import stats
 from unidecode import unidecode
 from statistics import mean
 import nest
-from levenshtein import distance_within
+from levenshtein import DistanceCache, distance_matrix, pair_distances, pair_list_distances
+from language_data import load_language
+from connectivity import Projection
+from connectivity_templates import load_template
 from nltk.probability import FreqDist
-from neuro_reporting import reset_reporting, insert_probe, write_readings, decide_spikes
+from neuro_reporting import (reset_reporting, insert_probe, remove_probe, clear_probe_events,
+                             write_readings, decide_spikes, score_spikes, phase, timed, count, begin_step, end_step,
+                             enable_instrumentation, take_stats)
 
 ###nest.set_verbosity('M_ERROR') # don't print detailed simulation info
 
 def decompose_word(word):
     "Get a list of graphemes in the word."
-    current_pos = 0
-    graphemes = []
-    while current_pos < len(word):
-        found = False
-        for len_graphemes in reversed(graphemes_by_lengths):
-            for grapheme in len_graphemes:
-                if word[current_pos:current_pos+len(grapheme)] == grapheme:
-                    graphemes.append(grapheme)
-                    found = True
-                    break
-            if found:
-                break
-        else:
-            raise ValueError('Cannot decompose string {} in word {}'.format(word[current_pos:], word))
-        current_pos += len(graphemes[-1])
-    return graphemes
+    return language().decompose(word)
+
+def create_neurons(neurons_n):
+    count('neurons_created', neurons_n)
+    return nest.Create(prm['neuron_type'], neurons_n)
 
 def make_hypercolumn(stimuli_set, column_size):
-    return dict([(s, nest.Create(prm['neuron_type'], column_size)) for s in stimuli_set])
+    return dict([(s, create_neurons(column_size)) for s in stimuli_set])
 
 def all_columns_cells(hypercol):
     return sum([list(col) for (label, col) in hypercol.items()], [])
@@ -37,11 +32,47 @@ def all_columns_cells(hypercol):
 # Global config.
 prm = {
         'max_text_len': 12,
+        # If True, networks have only as many letter and grapheme hypercolumns as the input length plus
+        # the margin (at most max_text_len), instead of always max_text_len.
+        'dynamic_length': False,
+        'dynamic_length_margin': 3,
         'letter_focus_time': 50.0,
         'decision_threshold': 150.0,
+        # Stop reading when the word read (see word_read), after the reading head passed the input, stays
+        # the same and ended by a grapheme below decision_threshold for this many steps (None: always read
+        # max_text_len (or the network length) steps).
+        'early_stopping_steps': None,
         'readings_path': 'readings/',
         'language_data_path': './pol/',
         'stems_and_suffixes': True,
+        'local_num_threads': 9, # NEST threads (of each process, when reading in parallel)
+        # Seed of NEST's global random generator; the generators of threads get the following numbers
+        # (0 gives the seeds NEST uses by default).
+        'nest_seed': 0,
+        # If True, letter columns are driven by spike trains generated beforehand from drive_seed (as
+        # by the Poisson generators), which are the same in any circuit reading the same input. Batch
+        # reading (see BatchReader) always uses them.
+        'pregenerated_drive': False,
+        'drive_seed': 0,
+        'reading_batch_size': 16, # circuits simulated together by simulate_reading_batch
+        # Which probes record membrane potentials: 'all', 'charted' (only probes charted also in
+        # non-thorough readings) or 'spikes' (none), and how often (ms).
+        'recording_policy': 'all',
+        'recording_interval': 1.0,
+        # Pairs of words with distances kept between inputs (see DistanceCache; about 17 bytes each, and
+        # enough for the pairs of 2000 candidate words).
+        'word_distances_cache_size': 2500000,
+        # If True, readers change the lexical subnetwork of the previous input into the one of the next
+        # input (see Reader.update_lexicon) instead of replacing it, which makes similar consecutive inputs
+        # cheaper to prepare, and batches are ordered by similarity of inputs (see overlap_order). The
+        # connections are then made in another order than in a fresh build, so a reading depends on the
+        # inputs read before it (and on their order); such readings are not cached.
+        'incremental_lexicon': False,
+        # Readings kept on disk for reuse (see reading_cache.py): where, how many and whether to bypass
+        # (neither look up nor store) them.
+        'reading_cache_path': 'reading_cache/',
+        'reading_cache_size': 100000,
+        'reading_cache_bypass': False,
 
         'neuron_type': 'iaf_psc_alpha',
         'letter_neuron_params_on': { 'I_e': 900.0 }, # constant input current in pA
@@ -86,266 +117,914 @@ prm = {
         # (the _model part in name is meant to mark that we register a separate synampse 'type')
         }
 
-# Read language data.
-letters, graphemes, vocabulary = None, None, dict()
-with open(prm['language_data_path']+'letters') as fl:
-    letters = fl.read().strip().split()
-with open(prm['language_data_path']+'graphemes') as fl:
-    graphemes = fl.read().strip().split()
-# Vocabulary is sorted by the first letter.
-skipped_words_n = 0
-vocabulary_path = prm['language_data_path'] + ('stems'
-                                               if prm['stems_and_suffixes']
-                                               else 'vocabulary')
-with open(vocabulary_path) as fl:
-    for line in fl:
-        line = line.strip()
-        if [lett for lett in line if not lett in letters]:
-            skipped_words_n += 1
-            continue
-        index_lett = unidecode(line[0])
-        if not index_lett in vocabulary:
-            vocabulary[index_lett] = []
-        vocabulary[index_lett].append(line)
-print('{} vocabulary words skipped (unknown letters present)'.format(skipped_words_n))
-# Suffixes are saved only as lists of their graphemes.
-suffixes = []
-if prm['stems_and_suffixes']:
-    with open(prm['language_data_path'] + 'suffixes') as fl:
-        for line in fl:
-            suffix = line.strip()
-            suffixes.append(suffix)
-
-graphemes_by_lengths = [[g for g in graphemes if len(g) == l]
-                        for l in range(max([len(g) for g in graphemes])+1)]
+# The language data is loaded on first use, from the compiled file kept in prm['language_data_path']
+# (see language_data.py).
+loaded_languages = dict() # (path, stems_and_suffixes) -> LanguageData
+
+def language():
+    "Get the language data for the current prm['language_data_path'] and prm['stems_and_suffixes']."
+    key = (prm['language_data_path'], prm['stems_and_suffixes'])
+    if not key in loaded_languages:
+        loaded_languages[key] = load_language(*key)
+    return loaded_languages[key]
+
+def __getattr__(name):
+    # Make the language data available also as module attributes, as when it was read at import.
+    if name in ['letters', 'graphemes', 'graphemes_by_lengths', 'vocabulary', 'suffixes']:
+        return getattr(language(), name)
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+def network_length(net_text_input, params=None):
+    """Get the number of letter and grapheme hypercolumns of a network for reading the input (with
+    params instead of prm, if given)."""
+    params = params or prm
+    if params['dynamic_length']:
+        return min(len(net_text_input) + params['dynamic_length_margin'], params['max_text_len'])
+    return params['max_text_len']
+
+@timed('vocabulary')
+def candidate_words(net_text_input, max_distance=4):
+    "Get the vocabulary words (with the same first letter) within max_distance edits from the input."
+    index_lett = unidecode(net_text_input[0])
+    candidate_index = language().candidate_indices[index_lett]
+    # NOTE we may compare only stems to the full input!
+    # (distance 0 means the exact input, which is not taken as a candidate, as when the vocabulary was
+    # scanned with distance_within)
+    return [w for (w, distance) in candidate_index.search(net_text_input, max_distance)
+            if distance]
 
 # These have to be declared globally to be available to separate saving functions.
 spike_groups, spike_decisions = {}, {} # to be filled when preparing a simulation
 
-def simulate_reading(net_text_input):
-    if len(net_text_input) > prm['max_text_len']:
-        raise ValueError('Text input {} has to be shorter than max_text_len: {}'.format(net_text_input, prm['max_text_len']))
+def get_connections(*args, **kwargs):
+    "Call nest.GetConnections (counting the calls)."
+    count('get_connections_calls')
+    return nest.GetConnections(*args, **kwargs)
 
-    # Build the network.
-    nest.ResetKernel()
-    nest.SetKernelStatus({'local_num_threads': 9})
-    reset_reporting()
-    spike_groups.clear()
-    spike_decisions.clear()
+def disconnect(conns):
+    "Remove connections, given as returned by nest.GetConnections."
+    if not conns:
+        return
+    model_pairs = dict()
+    for (source, target, model) in nest.GetStatus(conns, ['source', 'target', 'synapse_model']):
+        sources, targets = model_pairs.setdefault(str(model), ([], []))
+        sources.append(source)
+        targets.append(target)
+    for (model, (sources, targets)) in model_pairs.items():
+        nest.Disconnect(sources, targets, 'one_to_one', { 'model': model })
+
+def connection_ends(conns):
+    "Get arrays of sources and targets of connections."
+    if not conns:
+        return (np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+    return tuple(np.array(nest.GetStatus(conns, ['source', 'target']), dtype=int).T)
+
+kernel_builds = 0 # kernels set up so far (readers built before the latest one are not usable)
 
+def setup_kernel(recording_policy=None):
+    "Reset the NEST kernel for building reading circuits, returning the seeds of its random generators."
+    global kernel_builds
+    nest.ResetKernel()
+    kernel_builds += 1
+    nest.SetKernelStatus({'local_num_threads': prm['local_num_threads']})
+    vps_n = nest.GetKernelStatus('total_num_virtual_procs')
+    nest.SetKernelStatus({'grng_seed': prm['nest_seed'],
+                          'rng_seeds': list(range(prm['nest_seed']+1, prm['nest_seed']+1+vps_n))})
+    reset_reporting(recording_policy or prm['recording_policy'], prm['recording_interval'])
     nest.CopyModel('tsodyks2_synapse', 'head_grapheme_synapse_model', prm['head_grapheme_synapse_model'])
     nest.CopyModel('tsodyks2_synapse', 'letter_lexical_synapse_model', prm['letter_lexical_synapse_model'])
+    # Separate models for connections with weights assigned on each step, so they can be found at once.
+    nest.CopyModel('static_synapse', 'letter_head_synapse_model')
+    nest.CopyModel('static_synapse', 'suffix_grapheme_synapse_model')
+    return dict(zip(['grng_seed', 'rng_seeds'], nest.GetKernelStatus(['grng_seed', 'rng_seeds'])))
+
+@timed('reset')
+def reset_kernel_state(kernel_seeds):
+    """Reset neurons and recorders and reseed the random generators. The kernel clock goes on (NEST 2.x
+    doesn't support setting it back): the next reading starts at the current time, with the origin of
+    generators moved there (see Reader.drive)."""
+    nest.ResetNetwork()
+    nest.SetKernelStatus(kernel_seeds)
+    clear_probe_events(nest.GetKernelStatus('time'))
+
+class Reader:
+    """A reading network which keeps its word-independent part between inputs.
+
+    The letter hypercolumns (with their Poisson generators), the reading head, the grapheme
+    hypercolumns, the suffix columns, the lexical inhibiting population and the connections
+    between them are built once, when the reader is created (this resets the NEST kernel, so
+    only the latest reader is usable). There are text_len letter and grapheme hypercolumns
+    (max_text_len by default, see also network_length and reader_for). For each input, read()
+    only resets the simulation state, switches the Poisson drive to the input's letters and
+    replaces the lexical subnetwork.
+
+    Guarantee: each read() starts from the state in which a freshly built network starts, so
+    the readings are the same as with simulate_reading (of the reader's text_len). Neurons and
+    recorders are reset, the random generators are reseeded with the seeds of the fresh kernel and
+    the generators driving letters count time from the start of the reading. Dynamic weights
+    (letter -> head, suffix -> grapheme) get back their initial values, and connections with
+    synapse state (head -> grapheme, letter -> lexical) are created anew (with NEST 2.16+ this state lives in the connection itself). Lexical
+    columns of previous inputs are disconnected and reused (with their multimeters) for the
+    columns of later inputs.
+    compare_with_fresh_build checks the guarantee on a list of words. With
+    prm['incremental_lexicon'], the lexical subnetwork is updated instead of replaced, and the
+    guarantee holds only up to the order of connections.
+
+    A reader with a name is one of the circuits of a BatchReader, which sets up the kernel: its
+    probes' names are prefixed with the name and it keeps its own spike groups and decisions
+    (otherwise they are the module's spike_groups and spike_decisions).
+    """
+
+    def __init__(self, recording_policy=None, text_len=None, name=None):
+        if prm['early_stopping_steps'] is not None and prm['early_stopping_steps'] < 1:
+            raise ValueError('early_stopping_steps should be None or at least 1, not {}'.format(prm['early_stopping_steps']))
+        self.text_len = text_len or prm['max_text_len']
+        self.name = name
+        if name is None:
+            self.kernel_seeds = setup_kernel(recording_policy)
+            self.probe_prefix = ''
+            self.spike_groups, self.spike_decisions = spike_groups, spike_decisions
+        else:
+            self.probe_prefix = name + ':'
+            self.spike_groups, self.spike_decisions = dict(), dict()
+        self.kernel_build = kernel_builds
+        self.pregenerated_drive = prm['pregenerated_drive'] or name is not None
+        self.language = language()
+        self.create_scaffold()
+        self.make_weight_schedules()
+
+        # The input-dependent parts, filled by read().
+        self.net_text_input = None
+        self.lexical_cols = dict()
+        self.spare_lexical_cols = [] # disconnected lexical columns, reused for new words
+        self.start_time = 0.0 # kernel time at which the current reading started
+        self.suffix_input_len = None # the input length for which letter -> suffix connections are made
+        self.word_distances = DistanceCache(prm['word_distances_cache_size'], 4)
+        self.dynamic_connections = dict() # cached by cache_dynamic_connections
+        self.steps_n = 0 # steps of the last reading, which can be fewer than text_len with early stopping
+        self.finished = False # whether the reading of the current input is finished
+        self.reading = None # the word read, when finished
+
+        self.connect_scaffold()
+        self.connect_head_graphemes()
+        self.insert_scaffold_probes()
+
+    @timed('network_creation')
+    def create_scaffold(self):
+        "Create the neurons and generators of the word-independent part of the network."
+        letters, graphemes, suffixes = self.language.letters, self.language.graphemes, self.language.suffixes
+        if prm['stems_and_suffixes']:
+            self.suffixes_cols = dict([(s, create_neurons(prm['lexical_column_size']))
+                                       for s in suffixes])
+        self.lexical_inhibiting_population = create_neurons(prm['lexical_inhibiting_pop_size'])
+        self.letter_hypercolumns = [make_hypercolumn(letters, prm['letter_column_size'])
+                                    for i in range(self.text_len)]
+        # Each letter column has its own Poisson generator, silent (rate 0) unless the letter is
+        # in the input. With the pregenerated drive, each letter neuron has its own spike generator.
+        if self.pregenerated_drive:
+            self.letter_generators = [dict([(letter, nest.Create('spike_generator', prm['letter_column_size']))
+                                            for letter in letters])
+                                      for i in range(self.text_len)]
+        else:
+            self.letter_generators = [dict([(letter, nest.Create('poisson_generator', 1,
+                                                                 dict(prm['letters_poisson_generator'],
+                                                                      rate=0.0)))
+                                            for letter in letters])
+                                      for i in range(self.text_len)]
+        count('devices_created', self.text_len * len(letters) * (prm['letter_column_size'] if self.pregenerated_drive
+                                                                  else 1))
+        # Reading heads' columns are sorted in separate lists by grapheme lengths.
+        self.reading_head_len_sorted = [make_hypercolumn(size_graphemes, prm['head_column_size'])
+                                        for size_graphemes in self.language.graphemes_by_lengths]
+        self.reading_head = {} # a 'flat' version
+        for len_graphemes in self.reading_head_len_sorted:
+            self.reading_head.update(len_graphemes)
+        self.grapheme_hypercolumns = [make_hypercolumn(graphemes, prm['grapheme_column_size'])
+                                      for i in range(self.text_len)]
+        self.letter_cells = sum([all_columns_cells(hypercol) for hypercol in self.letter_hypercolumns], [])
+        self.grapheme_cells = sum([all_columns_cells(hypercol) for hypercol in self.grapheme_hypercolumns], [])
+        self.letters_ascii = dict([(letter, unidecode(letter)) for letter in letters])
+
+        # Lookup arrays from neuron ids to their places in the scaffold, to find where connections
+        # belong in the weight tables.
+        self.scaffold_size = max(self.letter_cells + self.grapheme_cells
+                                 + all_columns_cells(self.reading_head)
+                                 + (all_columns_cells(self.suffixes_cols) if prm['stems_and_suffixes'] else [])) + 1
+        self.letter_hcol = self.cell_lookup([(col, hcol_n)
+                                             for (hcol_n, hypercol) in enumerate(self.letter_hypercolumns)
+                                             for col in hypercol.values()])
+        self.head_grapheme_len = self.cell_lookup([(col, ln)
+                                                   for (ln, len_graphemes) in enumerate(self.reading_head_len_sorted)
+                                                   for col in len_graphemes.values()])
+        self.grapheme_hcol = self.cell_lookup([(col, hcol_n)
+                                               for (hcol_n, hypercol) in enumerate(self.grapheme_hypercolumns)
+                                               for col in hypercol.values()])
+        self.grapheme_n = self.cell_lookup([(col, graphemes.index(grapheme))
+                                            for hypercol in self.grapheme_hypercolumns
+                                            for (grapheme, col) in hypercol.items()])
+
+        # Arrays of neuron ids of columns, for wiring them as given by the connectivity template.
+        self.template = load_template(prm['language_data_path'], self.language, prm)
+        self.letter_col_ids = np.array([[list(hypercol[letter]) for letter in letters]
+                                        for hypercol in self.letter_hypercolumns], dtype=int)
+        self.grapheme_col_ids = np.array([[list(hypercol[grapheme]) for grapheme in graphemes]
+                                          for hypercol in self.grapheme_hypercolumns], dtype=int)
+        self.head_col_ids = np.array([list(col) for col in self.reading_head.values()], dtype=int)
+        if prm['stems_and_suffixes']:
+            self.suffix_list = list(self.suffixes_cols)
+            self.suffix_col_ids = np.array([list(self.suffixes_cols[suffix]) for suffix in self.suffix_list],
+                                           dtype=int).reshape(len(self.suffix_list), prm['lexical_column_size'])
+
+    def cell_lookup(self, cols_values):
+        "Make an array mapping ids of scaffold neurons to values, given pairs (column, value)."
+        lookup = np.full(self.scaffold_size, -1, dtype=int)
+        for (col, value) in cols_values:
+            lookup[list(col)] = value
+        return lookup
+
+    def make_weight_schedules(self):
+        "Precompute the tables of dynamic weights."
+        steps = np.arange(self.text_len)
+        hcols = np.arange(self.text_len)
+        # Letter -> head: indexed by step, letter hypercolumn and grapheme length (shifting skew normal).
+        grapheme_lens = np.arange(len(self.reading_head_len_sorted))
+        self.letter_head_weights = (stats.skewnorm.pdf(hcols[None, :, None], 6, loc=steps[:, None, None]-0.7,
+                                                       scale=0.67) * 3000
+                                    / (1.0 + (grapheme_lens[None, None, :]-1)*prm['grapheme_length_damping']))
+        # Head -> grapheme: indexed by step and grapheme hypercolumn (normal parametrized by time for
+        # each target hypercolumn). hcol_n is treated as time step number (add one because of the
+        # first "dummy" step); the time in steps is step_n+2, as the simulation is then at
+        # (step_n+1) * letter_focus_time.
+        self.head_grapheme_weights = (stats.norm.pdf(steps[:, None] + 2.0, loc=hcols[None, :]+1, scale=1.0)
+                                      * prm['head_grapheme_base_weight'])
+        # Suffix -> grapheme: the weights depend on the stem end estimated during the simulation, so
+        # only the positions of graphemes in suffixes are stored (suffix, grapheme, position -> count,
+        # from the template).
+        if prm['stems_and_suffixes']:
+            self.suffix_positions = self.template['suffix_positions']
+            self.suffix_n = self.cell_lookup([(col, suffix_n)
+                                              for (suffix_n, suffix) in enumerate(self.suffix_list)
+                                              for col in [self.suffixes_cols[suffix]]])
+
+    def suffix_grapheme_weights(self, stem_end):
+        "Get suffix -> grapheme weights for the estimated stem end, indexed by suffix, grapheme and hypercolumn."
+        # Each occurence of a grapheme in suffix must exert is influence individually, they are then summed.
+        positions = np.arange(self.suffix_positions.shape[2])
+        hcols = np.arange(self.text_len)
+        position_weights = stats.norm.pdf(hcols[None, :], loc=stem_end+positions[:, None], scale=3.0)
+        return (np.einsum('sgp,ph->sgh', self.suffix_positions, position_weights)
+                * prm['suffix_grapheme_base_weight'])
+
+    def cache_dynamic_connections(self):
+        """Look up the connections which have weights assigned on each step (those not cached yet), with
+        their indices in the weight tables. Each kind has its own synapse model, and NEST keeps the
+        places of connections of a model (which the handles point to) while none of them are made or
+        removed: only the head -> grapheme connections, made anew for each input, are looked up again."""
+        if not 'letter_head' in self.dynamic_connections:
+            conns = get_connections(self.letter_cells, synapse_model='letter_head_synapse_model')
+            sources, targets = connection_ends(conns)
+            self.dynamic_connections['letter_head'] = (conns, self.letter_hcol[sources],
+                                                       self.head_grapheme_len[targets])
+        if not 'head_grapheme' in self.dynamic_connections:
+            conns = get_connections(all_columns_cells(self.reading_head), synapse_model='head_grapheme_synapse_model')
+            sources, targets = connection_ends(conns)
+            self.dynamic_connections['head_grapheme'] = (conns, self.grapheme_hcol[targets])
+        if prm['stems_and_suffixes'] and not 'suffix_grapheme' in self.dynamic_connections:
+            conns = get_connections(all_columns_cells(self.suffixes_cols),
+                                    synapse_model='suffix_grapheme_synapse_model')
+            sources, targets = connection_ends(conns)
+            suffix_ns, grapheme_ns = self.suffix_n[sources], self.grapheme_n[targets]
+            # Only connections to graphemes that are in the suffix get nonzero weights.
+            in_suffix = self.suffix_positions[suffix_ns, grapheme_ns].sum(axis=1) > 0
+            self.dynamic_connections['suffix_grapheme'] = ([c for (c, keep) in zip(conns, in_suffix) if keep],
+                                                           suffix_ns[in_suffix], grapheme_ns[in_suffix],
+                                                           self.grapheme_hcol[targets][in_suffix])
+
+    @timed('connection_building')
+    def connect_scaffold(self):
+        "Make the connections that don't depend on the input."
+        generator_letter = Projection()
+        letter_lateral = Projection()
+        letter_head = Projection('letter_head_synapse_model')
+        suffix_lateral = Projection()
+        suffix_grapheme = Projection('suffix_grapheme_synapse_model')
+        grapheme_lateral = Projection()
+        template = self.template
+        for (hcol_n, hypercol) in enumerate(self.letter_hypercolumns): # hypercol is: letter -> (neuron's nest id)
+            for (letter, letter_col) in hypercol.items():
+                if self.pregenerated_drive:
+                    generator_letter.add_pairs(self.letter_generators[hcol_n][letter], letter_col,
+                                               np.full(len(letter_col), prm['poisson_letter_excitation']['weight']))
+                else:
+                    generator_letter.add(self.letter_generators[hcol_n][letter], letter_col,
+                                         prm['poisson_letter_excitation'])
+            # Letter hypercol's lateral inhibition to subsequent hypercols
+            for hypercol2 in self.letter_hypercolumns[hcol_n+1:]:
+                letter_lateral.add(all_columns_cells(hypercol), all_columns_cells(hypercol2),
+                                   prm['letter_col_lateral_inhibition'])
+        # Letter hypercols -> the reading head (letters to graphemes containing them)
+        letter_ns, head_ns = template['letter_head_letters'], template['letter_head_heads']
+        letter_head.add_column_pairs(self.letter_col_ids[:, letter_ns].reshape(-1, self.letter_col_ids.shape[2]),
+                                     np.tile(self.head_col_ids[head_ns], (self.text_len, 1)),
+                                     np.tile(template['letter_head_weights'], self.text_len))
+        if prm['stems_and_suffixes']:
+            # Lateral inhibition for suffixes.
+            suffix_ns, suffix2_ns = np.nonzero(~np.eye(len(self.suffix_list), dtype=bool))
+            suffix_lateral.add_column_pairs(self.suffix_col_ids[suffix_ns], self.suffix_col_ids[suffix2_ns],
+                                            np.full(len(suffix_ns), prm['suffix_lateral_inhibition']['weight']))
+            for suffix_col in self.suffixes_cols.values():
+                # Suffix -> grapheme connections.
+                # (weights will be assigned dynamically later)
+                suffix_grapheme.add(suffix_col, self.grapheme_cells, 0.0)
+        # Lateral inhibition of graphemes in neighbouring hypercols (see the template)
+        sources, targets = template['grapheme_lateral_sources'], template['grapheme_lateral_targets']
+        for hcol_n in range(self.text_len):
+            neighbours = [n for n in [hcol_n-1, hcol_n+1] if 0 <= n < self.text_len]
+            if not neighbours:
+                continue
+            grapheme_lateral.add_column_pairs(
+                np.repeat(self.grapheme_col_ids[hcol_n][sources], len(neighbours), axis=0),
+                np.stack([self.grapheme_col_ids[n][targets] for n in neighbours], axis=1)
+                    .reshape(-1, self.grapheme_col_ids.shape[2]),
+                np.repeat(template['grapheme_lateral_weights'], len(neighbours)))
+        for projection in [generator_letter, letter_lateral, letter_head, suffix_lateral, suffix_grapheme,
+                           grapheme_lateral]:
+            projection.connect()
+
+    @timed('connection_building')
+    def connect_head_graphemes(self):
+        "Connect the reading head to the grapheme hypercolumns (these synapses keep a dynamic state)."
+        head_grapheme = Projection('head_grapheme_synapse_model', weighted=False)
+        # (each head column to its grapheme's columns in all hypercols)
+        head_grapheme.add_column_pairs(self.head_col_ids,
+                                       self.grapheme_col_ids[:, self.template['head_graphemes']]
+                                           .transpose(1, 0, 2).reshape(len(self.head_col_ids), -1))
+        head_grapheme.connect()
+
+    @timed('probes')
+    def insert_scaffold_probes(self):
+        prefix = self.probe_prefix
+        if prm['stems_and_suffixes']:
+            for (suffix, suffix_col) in self.suffixes_cols.items():
+                insert_probe(suffix_col, prefix+'suff_'+suffix, always_chart=False, layer='suffixes')
+        insert_probe(self.lexical_inhibiting_population, prefix+'lexical_inhibition', layer='lexical_inhibition')
+        ##for (letter, letter_col) in self.letter_hypercolumns[1].items():
+        ##    insert_probe(letter_col, 'L2-'+letter)
+        for (grapheme, grapheme_col) in self.reading_head.items():
+            insert_probe(grapheme_col, prefix+'head-'+grapheme, always_chart=False, layer='head')
+        for (hcol_n, hypercol) in enumerate(self.grapheme_hypercolumns):
+            for (grapheme, grapheme_col) in hypercol.items():
+                insert_probe(grapheme_col, '{}g{}-{}'.format(prefix, hcol_n, grapheme), always_chart=False,
+                             layer='graphemes')
+
+    @timed('reset')
+    def reset_state(self):
+        """Bring the network back to the state of a fresh build (without the lexical subnetwork). The
+        kernel state is reset separately, with reset_kernel_state."""
+        # (weights are only ever changed through the cached connections)
+        if 'letter_head' in self.dynamic_connections:
+            nest.SetStatus(self.dynamic_connections['letter_head'][0], prm['letter_head_excitation'])
+        if 'suffix_grapheme' in self.dynamic_connections:
+            nest.SetStatus(self.dynamic_connections['suffix_grapheme'][0], { 'weight': 0.0 })
+        disconnect(get_connections(all_columns_cells(self.reading_head),
+                                   synapse_model='head_grapheme_synapse_model'))
+        self.connect_head_graphemes()
+        self.dynamic_connections.pop('head_grapheme', None)
+
+    @timed('drive')
+    def drive(self, net_text_input):
+        "Set the Poisson drive of letter columns to the input letters, from the start of the reading."
+        if self.pregenerated_drive:
+            generators, trains = [], []
+            for (hcol_n, hcol_generators) in enumerate(self.letter_generators):
+                for (letter, generator) in hcol_generators.items():
+                    on = hcol_n < len(net_text_input) and net_text_input[hcol_n] == letter
+                    generators += list(generator)
+                    trains += (self.letter_spike_trains(hcol_n, letter) if on
+                               else [[] for neuron in generator])
+            # (spike times are relative to the origin)
+            nest.SetStatus(generators, { 'origin': self.start_time })
+            nest.SetStatus(generators, [{ 'spike_times': train } for train in trains])
+            return
+        for (hcol_n, generators) in enumerate(self.letter_generators):
+            for (letter, generator) in generators.items():
+                on = hcol_n < len(net_text_input) and net_text_input[hcol_n] == letter
+                nest.SetStatus(generator, { 'rate': prm['letters_poisson_generator']['rate'] if on else 0.0,
+                                            'origin': self.start_time })
+
+    def letter_spike_trains(self, hcol_n, letter):
+        """Generate Poisson spike trains (lists of times in ms) for the neurons of a letter column driven
+        in the hypercolumn. They depend only on drive_seed, the hypercolumn and the letter."""
+        generator_prm = prm['letters_poisson_generator']
+        resolution = nest.GetKernelStatus('resolution')
+        # (the reading takes at most text_len+1 focus periods)
+        stop = min(generator_prm['stop'], (self.text_len+1) * prm['letter_focus_time'])
+        rng = np.random.default_rng([prm['drive_seed'], hcol_n, self.language.letters.index(letter)])
+        trains = []
+        for neuron_n in range(prm['letter_column_size']):
+            times = generator_prm['start'] + np.cumsum(rng.exponential(1000.0 / generator_prm['rate'],
+                                                                        int(generator_prm['rate'] * stop / 1000.0 * 1.5) + 10))
+            time_steps = np.unique(np.ceil(times[times < stop] / resolution))
+            trains.append((time_steps * resolution).round(3).tolist())
+        return trains
+
+    @timed('connection_building')
+    def connect_suffixes(self, input_len):
+        "Connect the letter hypercolumns to suffixes that can span to the end of input of the given length."
+        if self.suffix_input_len is not None:
+            disconnect(get_connections(self.letter_cells, all_columns_cells(self.suffixes_cols)))
+        self.suffix_input_len = input_len
+        letter_suffix = Projection()
+        template = self.template
+        letters_n = self.letter_col_ids.shape[1]
+        for hcol_n in range(self.text_len):
+            # Suffixes which can span from the hypercol to the end of input, each from all the letters.
+            suffix_ns = np.repeat(np.nonzero(input_len-hcol_n <= template['suffix_lens'])[0], letters_n)
+            letter_ns = np.tile(np.arange(letters_n), len(suffix_ns) // letters_n)
+            letter_suffix.add_column_pairs(self.letter_col_ids[hcol_n][letter_ns], self.suffix_col_ids[suffix_ns],
+                                           np.where(template['suffix_letter_member'][suffix_ns, letter_ns],
+                                                    template['suffix_member_weights'][suffix_ns],
+                                                    template['suffix_absent_weights'][suffix_ns]))
+        letter_suffix.connect()
+
+    @timed('reset')
+    def detach_lexicon(self, words=None):
+        """Disconnect the lexical columns of the words (all of them by default) and unregister their probes.
+        The columns are kept to be reused for new words."""
+        words = list(self.lexical_cols) if words is None else words
+        if not words:
+            return
+        detached_cols = dict([(word, self.lexical_cols.pop(word)) for word in words])
+        detached_cells = all_columns_cells(detached_cols)
+        kept_cells = all_columns_cells(self.lexical_cols)
+        others = list(self.lexical_inhibiting_population) + self.grapheme_cells
+        # (connections with probes' devices are left alone)
+        disconnect(get_connections(detached_cells, detached_cells + kept_cells + others))
+        disconnect(get_connections(self.letter_cells + others + kept_cells, detached_cells))
+        for word in words:
+            remove_probe(self.probe_prefix+word)
+        self.spare_lexical_cols += list(detached_cols.values())
+
+    @timed('lexicon')
+    def attach_lexicon(self, net_text_input):
+        "Create and connect the lexical columns of candidate words for the input."
+        local_vocabulary = candidate_words(net_text_input)
+        count('candidate_words', len(local_vocabulary))
+        graphemes_dist = FreqDist(chain.from_iterable([decompose_word(w) for w in local_vocabulary]))
+
+        with phase('network_creation'):
+            self.lexical_cols = dict([(w, self.new_lexical_col()) for w in local_vocabulary])
+        self.connect_lexicon(local_vocabulary, graphemes_dist)
+        self.insert_lexical_probes(local_vocabulary)
+        return local_vocabulary
+
+    @timed('lexicon')
+    def update_lexicon(self, net_text_input):
+        """Turn the lexical subnetwork of the previous input into the one for this input (see
+        prm['incremental_lexicon']): only the columns of words which are no longer candidates are
+        disconnected, and only those of new candidates are connected (reusing disconnected columns).
+        The lexical -> grapheme weights of the kept words are set for the new grapheme frequencies."""
+        local_vocabulary = candidate_words(net_text_input)
+        count('candidate_words', len(local_vocabulary))
+        graphemes_dist = FreqDist(chain.from_iterable([decompose_word(w) for w in local_vocabulary]))
+        candidates = set(local_vocabulary)
+        new_words = [w for w in local_vocabulary if not w in self.lexical_cols]
+        self.detach_lexicon([w for w in self.lexical_cols if not w in candidates])
+        count('kept_lexical_columns', len(self.lexical_cols))
 
-    local_vocabulary = [w for w in vocabulary[unidecode(net_text_input[0])]
-                        if distance_within(w, net_text_input, 4)] # NOTE we may compare only stems to the full input!
-    graphemes_dist = FreqDist(chain.from_iterable([decompose_word(w) for w in local_vocabulary]))
-
-    lexical_cols = dict([(w, nest.Create(prm['neuron_type'], prm['lexical_column_size']))
-                         for w in local_vocabulary])
-    if prm['stems_and_suffixes']:
-        suffixes_cols = dict([(s, nest.Create(prm['neuron_type'], prm['lexical_column_size']))
-                            for s in suffixes])
-    lexical_inhibiting_population = nest.Create(prm['neuron_type'], prm['lexical_inhibiting_pop_size'])
-    letter_hypercolumns = [make_hypercolumn(letters, prm['letter_column_size'])
-                           for i in range(prm['max_text_len'])]
-    # Reading heads' columns are sorted in separate lists by grapheme lengths.
-    reading_head_len_sorted = [make_hypercolumn(size_graphemes, prm['head_column_size'])
-                              for size_graphemes in graphemes_by_lengths]
-    reading_head = {} # a 'flat' version
-    for len_graphemes in reading_head_len_sorted:
-        reading_head.update(len_graphemes)
-    grapheme_hypercolumns = [make_hypercolumn(graphemes, prm['grapheme_column_size'])
-                             for i in range(prm['max_text_len'])]
-
-    # Make connections.
-    end_weight_dist = stats.norm(loc=len(net_text_input), scale=3.0) # for exciting suffixes
-    for (hcol_n, hypercol) in enumerate(letter_hypercolumns): # hypercol is: letter -> (neuron's nest id)
-        # Turn on appropriate letter columns.
-        if hcol_n < len(net_text_input) and net_text_input[hcol_n] in letters:
-            poisson_gen = nest.Create('poisson_generator', 1, prm['letters_poisson_generator'])
-            nest.Connect(poisson_gen, hypercol[net_text_input[hcol_n]], syn_spec=prm['poisson_letter_excitation'])
-            ###nest.SetStatus(hypercol[net_text_input[hcol_n]], prm['letter_neuron_params_on'])
-
-        # Letter hypercol's lateral inhibition to subsequent hypercols
-        for hypercol2 in letter_hypercolumns[hcol_n+1:]:
-            nest.Connect(all_columns_cells(hypercol), all_columns_cells(hypercol2),
-                         syn_spec=prm['letter_col_lateral_inhibition'])
-        # Letter hypercol -> the reading head
-        for (letter, letter_col) in hypercol.items():
-            for (grapheme, grapheme_col) in reading_head.items():
-                if letter in grapheme:
-                    nest.Connect(letter_col, grapheme_col, syn_spec=prm['letter_head_excitation'])
-        # Letter hypercol -> lexical units
+        if self.lexical_cols:
+            kept_cells = all_columns_cells(self.lexical_cols)
+            # Letter -> lexical synapses keep a dynamic state, so they are made anew for all the words.
+            disconnect(get_connections(self.letter_cells, kept_cells, synapse_model='letter_lexical_synapse_model'))
+            conns = get_connections(kept_cells, self.grapheme_cells)
+            if conns:
+                graphemes = self.language.graphemes
+                nest.SetStatus(conns, [{ 'weight': (prm['lexical_grapheme_base_excitation_weight']
+                                                    / graphemes_dist.freq(graphemes[grapheme_n])) }
+                                       for grapheme_n in self.grapheme_n[connection_ends(conns)[1]]])
+        with phase('network_creation'):
+            for word in new_words:
+                self.lexical_cols[word] = self.new_lexical_col()
+        self.connect_lexicon(new_words, graphemes_dist)
+        self.insert_lexical_probes(new_words)
+        return local_vocabulary
+
+    def new_lexical_col(self):
+        "Get a lexical column for a new word: a detached one, if there is any, otherwise new neurons."
+        if self.spare_lexical_cols:
+            return self.spare_lexical_cols.pop()
+        return create_neurons(prm['lexical_column_size'])
+
+    def connect_lexicon(self, new_words, graphemes_dist):
+        """Connect the lexical columns of the new words (their letter -> lexical connections are made for
+        all the columns, see update_lexicon)."""
+        lexical_cols = self.lexical_cols
+        new_cols = dict([(word, lexical_cols[word]) for word in new_words])
+        letter_lexical = Projection('letter_lexical_synapse_model')
+        shorter_word = Projection()
         for (word, word_col) in lexical_cols.items():
-            if hcol_n >= len(word):
-                nest.Connect(all_columns_cells(hypercol), word_col, syn_spec=prm['shorter_word_inhibition'])
-            else:
+            word_ascii = unidecode(word)
+            # (letters are compared one by one, as a letter may be transliterated into several characters)
+            word_letters_ascii = [unidecode(letter) for letter in word]
+            for (hcol_n, hypercol) in enumerate(self.letter_hypercolumns[:len(word)]):
+                # Letter hypercol -> lexical units
                 for (letter, letter_col) in hypercol.items():
-                    if hcol_n == 0 and unidecode(word[hcol_n]) == unidecode(letter):
-                        nest.Connect(letter_col, word_col, syn_spec='letter_lexical_synapse_model')
-                        nest.SetStatus(nest.GetConnections(letter_col, word_col),
-                                       prm['member_first_letter_excitation'])
+                    letter_ascii = self.letters_ascii[letter]
                     if (not prm['stems_and_suffixes']
-                            and hcol_n == len(word)-1 and unidecode(word[len(word)-1]) == unidecode(letter)):
-                        nest.Connect(letter_col, word_col, syn_spec='letter_lexical_synapse_model')
-                        nest.SetStatus(nest.GetConnections(letter_col, word_col),
-                                       prm['member_last_letter_excitation'])
-                    elif unidecode(letter) in unidecode(word):
-                        nest.Connect(letter_col, word_col, syn_spec='letter_lexical_synapse_model')
-                        nest.SetStatus(nest.GetConnections(letter_col, word_col),
-                                       prm['member_letter_excitation'](len(word)))
+                            and hcol_n == len(word)-1 and word_letters_ascii[len(word)-1] == letter_ascii):
+                        weight = prm['member_last_letter_excitation']
+                    elif letter_ascii in word_ascii:
+                        weight = prm['member_letter_excitation'](len(word))
                     else:
-                        nest.Connect(letter_col, word_col, syn_spec='letter_lexical_synapse_model')
-                        nest.SetStatus(nest.GetConnections(letter_col, word_col),
-                                       prm['absent_letter_inhibition'](len(word)))
-        # Letter hypercol -> suffixes units
+                        weight = prm['absent_letter_inhibition'](len(word))
+                    letter_lexical.add(letter_col, word_col, weight)
+                    if hcol_n == 0 and word_letters_ascii[hcol_n] == letter_ascii:
+                        # The first letter gets a second connection. Its member_first_letter_excitation
+                        # weight used to be overwritten with the weight above (by setting weights of all
+                        # the letter -> word connections), and the tuned parameters assume that.
+                        letter_lexical.add(letter_col, word_col, weight)
+        for (word, word_col) in new_cols.items():
+            for hypercol in self.letter_hypercolumns[len(word):]:
+                shorter_word.add(all_columns_cells(hypercol), word_col, prm['shorter_word_inhibition'])
+        lexical_inhibition = Projection()
+        lexical_inhibition.add(all_columns_cells(new_cols), self.lexical_inhibiting_population,
+                               prm['lexical_inhibiting_pop_excitation'])
+        lexical_grapheme = Projection()
+        grapheme_lexical = Projection()
+        lexical_lateral = Projection()
+        for (word, word_col) in new_cols.items():
+            lexical_inhibition.add(self.lexical_inhibiting_population, word_col,
+                                   prm['lexical_inhibiting_pop_feedback'](len(word)))
+            word_decomposition = decompose_word(word)
+            for (hcol_n, hypercol) in enumerate(self.grapheme_hypercolumns[:len(word_decomposition)]):
+                lexical_grapheme.add(word_col, hypercol[word_decomposition[hcol_n]],
+                                     (prm['lexical_grapheme_base_excitation_weight']
+                                      # the excitation is stronger with rarer letters:
+                                      / graphemes_dist.freq(word_decomposition[hcol_n])))
+                # Grapheme -> lexical feedback.
+                grapheme_lexical.add(hypercol[word_decomposition[hcol_n]], word_col,
+                                     prm['grapheme_lexical_feedback'])
+        # Lateral inhibition for similar words (pairs with at least one new word).
+        words = list(lexical_cols)
+        if new_words:
+            # (only the pairs with a new word are measured, each once)
+            is_new = np.array([word in new_cols for word in words])
+            new_ns = np.nonzero(is_new)[0]
+            firsts, seconds = np.repeat(new_ns, len(words)), np.tile(np.arange(len(words)), len(new_ns))
+            measured = ~is_new[seconds] | (firsts < seconds)
+            firsts, seconds = firsts[measured], seconds[measured]
+            distances = pair_list_distances(words, firsts, seconds, 4, cache=self.word_distances)
+            close = (distances > 0) & (distances <= 4)
+            similar = np.zeros((len(words), len(words)), dtype=bool)
+            similar[firsts[close], seconds[close]] = True
+            similar[seconds[close], firsts[close]] = True
+            similar_words, similar_words2 = np.nonzero(similar)
+            cols = np.array([lexical_cols[word] for word in words])
+            lexical_lateral.add_pairs(np.repeat(cols[similar_words], cols.shape[1], axis=1).ravel(),
+                                      np.tile(cols[similar_words2], (1, cols.shape[1])).ravel(),
+                                      np.full(len(similar_words) * cols.shape[1]**2,
+                                              prm['lexical_lateral_inhibition']['weight']))
+        for projection in [letter_lexical, shorter_word, lexical_inhibition, lexical_grapheme,
+                           grapheme_lexical, lexical_lateral]:
+            projection.connect()
+
+    @timed('probes')
+    def insert_lexical_probes(self, words):
+        for word in words:
+            insert_probe(self.lexical_cols[word], self.probe_prefix+word, always_chart=False, layer='lexical')
+
+    def prepare(self, net_text_input):
+        """Set up the circuit for reading the input: reset it if it was used and connect it to the input.
+        The kernel state has to be reset before, if the kernel was simulated."""
+        if len(net_text_input) > self.text_len:
+            raise ValueError('Text input {} has to be shorter than the network length: {}'.format(net_text_input, self.text_len))
+
+        if self.net_text_input is not None:
+            self.reset_state()
+        self.spike_groups.clear()
+        self.spike_decisions.clear()
+        self.steps_n, self.finished, self.reading = 0, False, None
+        self.final_spike_counts = None # (taken when finished, for circuits of a batch)
+        self.last_reading, self.stable_steps_n = None, 0 # for early stopping
+        self.net_text_input = net_text_input
+        self.start_time = nest.GetKernelStatus('time')
+        self.drive(net_text_input)
+        if prm['stems_and_suffixes'] and self.suffix_input_len != len(net_text_input):
+            self.connect_suffixes(len(net_text_input))
+        if prm['incremental_lexicon']:
+            local_vocabulary = self.update_lexicon(net_text_input)
+        else:
+            self.detach_lexicon()
+            local_vocabulary = self.attach_lexicon(net_text_input)
+
+        # [Reading facility config:]
+        prefix = self.probe_prefix
+        self.spike_groups['Head'] = [prefix+'head-'+g for g in self.language.graphemes]
+        self.spike_groups['Words'] = [prefix+w for w in local_vocabulary]
         if prm['stems_and_suffixes']:
-            for (suffix, suffix_col) in suffixes_cols.items():
-                if len(net_text_input)-hcol_n <= len(suffix):
-                    for (letter, letter_col) in hypercol.items():
-                        if letter in suffix:
-                            nest.Connect(letter_col, suffix_col,
-                                        syn_spec=prm['member_letter_excitation_suffix'](len(suffix)))
-                        else:
-                            nest.Connect(letter_col, suffix_col,
-                                        syn_spec=prm['absent_letter_inhibition_suffix'](len(suffix)))
-    for (grapheme, grapheme_col) in reading_head.items():
-        nest.Connect(grapheme_col,
-                     sum([list(neurs)
-                          for hypercol in grapheme_hypercolumns
-                          for (label, neurs) in hypercol.items()
-                          if label == grapheme], []),
-                     syn_spec='head_grapheme_synapse_model')
-    nest.Connect(all_columns_cells(lexical_cols), lexical_inhibiting_population,
-                 syn_spec=prm['lexical_inhibiting_pop_excitation'])
-    for (word, word_col) in lexical_cols.items():
-        nest.Connect(lexical_inhibiting_population, word_col,
-                    syn_spec=prm['lexical_inhibiting_pop_feedback'](len(word)))
-        word_decomposition = decompose_word(word)
-        for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-            if hcol_n == len(word_decomposition):
-                break
-            nest.Connect(word_col, hypercol[word_decomposition[hcol_n]],
-                         syn_spec={ 'weight': (prm['lexical_grapheme_base_excitation_weight']
-                                                # the excitation is stronger with rarer letters:
-                                                / graphemes_dist.freq(word_decomposition[hcol_n]))})
-            # Grapheme -> lexical feedback.
-            nest.Connect(hypercol[word_decomposition[hcol_n]], word_col,
-                         syn_spec=prm['grapheme_lexical_feedback'])
-        # Lateral inhibition for similar words.
-        for (word2, word2_col) in lexical_cols.items():
-            if word2 == word:
-                continue
-            elif distance_within(word, word2, 4):
-                nest.Connect(word_col, word2_col, syn_spec=prm['lexical_lateral_inhibition'])
-    if prm['stems_and_suffixes']:
-        for (suffix, suffix_col) in suffixes_cols.items():
-            # Lateral inhibition for suffixes.
-            for (suffix2, suffix2_col) in  suffixes_cols.items():
-                if suffix != suffix2:
-                    nest.Connect(suffix_col, suffix2_col, syn_spec=prm['suffix_lateral_inhibition'])
-            # Suffix -> grapheme connections.
-            for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-                # (weights will be assigned dynamically later)
-                nest.Connect(suffix_col, all_columns_cells(hypercol), syn_spec={ 'weight': 0.0 })
-    for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-        for (grapheme, col) in hypercol.items():
-            # Lateral inhibition of graphemes containing at least one same letter
-            if hcol_n != 0:
-                for similar_grapheme in [g for g in graphemes if len(set(g).union(set(grapheme))) > 0]:
-                    nest.Connect(col, grapheme_hypercolumns[hcol_n-1][similar_grapheme],
-                                 syn_spec=prm['grapheme_lateral_inhibition'](len(similar_grapheme)))
-            if hcol_n+1 != prm['max_text_len']:
-                for similar_grapheme in [g for g in graphemes if len(set(g).union(set(grapheme))) > 0]:
-                    nest.Connect(col, grapheme_hypercolumns[hcol_n+1][similar_grapheme],
-                                 syn_spec=prm['grapheme_lateral_inhibition'](len(similar_grapheme)))
-
-    # Insert probes:
-    for (word, word_col) in lexical_cols.items():
-        insert_probe(word_col, word, always_chart=False)
-    if prm['stems_and_suffixes']:
-        for (suffix, suffix_col) in suffixes_cols.items():
-            insert_probe(suffix_col, 'suff_'+suffix, always_chart=False)
-    insert_probe(lexical_inhibiting_population, 'lexical_inhibition')
-    ##for (letter, letter_col) in letter_hypercolumns[1].items():
-    ##    insert_probe(letter_col, 'L2-'+letter)
-    for (grapheme, grapheme_col) in reading_head.items():
-        insert_probe(grapheme_col, 'head-'+grapheme, always_chart=False)
-    # [Reading facility config:]
-    spike_groups['Head'] = ['head-'+g for g in graphemes]
-    spike_groups['Words'] = local_vocabulary
-    if prm['stems_and_suffixes']:
-        spike_groups['Suffixes'] = ['suff_'+suff for suff in suffixes]
-        spike_decisions['Stems'] = [ local_vocabulary ]
-    spike_decisions['Reading'] = []
-    for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-        spike_decisions['Reading'].append([])
-        for (grapheme, grapheme_col) in hypercol.items():
-            insert_probe(grapheme_col, 'g{}-{}'.format(hcol_n, grapheme), always_chart=False)
-            spike_decisions['Reading'][-1].append('g{}-{}'.format(hcol_n, grapheme))
-
-    # Run the simulation, write readings.
-    nest.Simulate(prm['letter_focus_time'])
-    for step_n in range(prm['max_text_len']):
+            self.spike_groups['Suffixes'] = [prefix+'suff_'+suff for suff in self.language.suffixes]
+            self.spike_decisions['Stems'] = [ [prefix+w for w in local_vocabulary] ]
+        self.spike_decisions['Reading'] = [['{}g{}-{}'.format(prefix, hcol_n, grapheme) for grapheme in hypercol]
+                                           for (hcol_n, hypercol) in enumerate(self.grapheme_hypercolumns)]
+
+    @timed('weight_updates')
+    def set_step_weights(self):
+        "Assign the dynamic weights for the next step of reading (after the first focus period)."
+        step_n = self.steps_n
+        # (NEST may reorder connections when preparing the simulation after they changed, so they are
+        # looked up only after the first period)
+        self.cache_dynamic_connections()
 
         # Reassign the letter -> head weights (shifting skew normal).
-        weights_dist = stats.skewnorm(6, loc=step_n-0.7, scale=0.67)
-        for assg_lett_n in range(prm['max_text_len']):
-            assg_hypercol = all_columns_cells(letter_hypercolumns[assg_lett_n])
-            for (ln, len_graphemes) in enumerate(reading_head_len_sorted):
-                len_graphemes = all_columns_cells(len_graphemes)
-                if len(len_graphemes) == 0:
-                    continue
-                nest.SetStatus( nest.GetConnections(assg_hypercol, len_graphemes),
-                                { 'weight' : (  weights_dist.pdf(assg_lett_n) * 3000
-                                              / (1.0 + (ln-1)*prm['grapheme_length_damping'])) })
+        conns, letter_hcols, grapheme_lens = self.dynamic_connections['letter_head']
+        nest.SetStatus(conns, 'weight', self.letter_head_weights[step_n][letter_hcols, grapheme_lens].tolist())
 
         # Reassign the head -> grapheme weights (normal parametrized by time for each target hypercolumn).
-        for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-            weights_dist = stats.norm(loc=hcol_n+1, scale=1.0) # hcol_n is treated as time step number
-                                                               # (add one because of the first "dummy" step)
-            nest.SetStatus( nest.GetConnections(all_columns_cells(reading_head),
-                                                all_columns_cells(hypercol)),
-                            { 'weight' : weights_dist.pdf(1.0 + nest.GetKernelStatus('time') / prm['letter_focus_time'])
-                                         * prm['head_grapheme_base_weight'] })
+        conns, grapheme_hcols = self.dynamic_connections['head_grapheme']
+        nest.SetStatus(conns, 'weight', self.head_grapheme_weights[step_n][grapheme_hcols].tolist())
 
         # Reassign the suffix -> grapheme weights (depending on estimated stem end).
         if prm['stems_and_suffixes']:#### and step_n > len(net_text_input)/2:
-            stem_end = mean([len(stem_reading[0]) for stem_reading in decide_spikes(spike_decisions['Stems'])[:15]])
+            stem_end = mean([len(stem_reading[0]) - len(self.probe_prefix)
+                             for stem_reading in decide_spikes(self.spike_decisions['Stems'])[:15]])
             #print(stem_end)
-            for (suffix, suffix_col) in suffixes_cols.items():
-                suffix_decomposition = decompose_word(suffix)
-                for grapheme in set(suffix_decomposition):
-                    # Each occurence of a grapheme in suffix must exert is
-                    # influence individually, they are then summed.
-                    indices = [gi for (gi, g) in enumerate(suffix_decomposition) if g == grapheme]
-                    weight_dists = [stats.norm(loc=stem_end+ind, scale=3.0)
-                                     for ind in indices]
-                    if len(weight_dists) == 0:
-                        continue
-                    for (hcol_n, hypercol) in enumerate(grapheme_hypercolumns):
-                        #print('stem_end', stem_end, 'hcol', hcol_n, weight_dists[0].pdf(hcol_n))
-                        nest.SetStatus( nest.GetConnections(suffix_col, hypercol[grapheme]),
-                                        { 'weight': sum( [dist.pdf(hcol_n) for dist in weight_dists] )
-                                                    * prm['suffix_grapheme_base_weight'] })
-
-        nest.Simulate(prm['letter_focus_time'])
+            conns, suffix_ns, grapheme_ns, grapheme_hcols = self.dynamic_connections['suffix_grapheme']
+            nest.SetStatus(conns, 'weight',
+                           self.suffix_grapheme_weights(stem_end)[suffix_ns, grapheme_ns, grapheme_hcols].tolist())
 
-def word_read():
-    if nest.GetKernelStatus('time') == 0.0:
-        raise RuntimeError('calling word_read with no simulation state available')
+    def finish_step(self):
+        "Note a simulated step; the reading is finished after text_len steps, or earlier with early stopping."
+        step_n = self.steps_n
+        self.steps_n += 1
+        if self.steps_n == self.text_len:
+            self.finished = True
+        elif prm['early_stopping_steps'] is not None and step_n >= len(self.net_text_input):
+            reading, ended = reading_from_decisions(decide_spikes(self.spike_decisions['Reading']))
+            if ended and reading == self.last_reading:
+                self.stable_steps_n += 1
+            else:
+                self.stable_steps_n = 0
+            self.last_reading = reading
+            if self.stable_steps_n >= prm['early_stopping_steps']:
+                self.finished = True
+        if self.finished:
+            self.reading = reading_from_decisions(decide_spikes(self.spike_decisions['Reading']))[0]
+            if self.name is not None:
+                # (the other circuits of the batch are still simulated, so the counts are taken now)
+                self.final_spike_counts = spike_counts(self.spike_groups, self.spike_decisions)
+                self.drive('')
 
-    word_decisions = decide_spikes(spike_decisions['Reading']) # get columns with their spike counts
-    stop_boundary = prm['max_text_len']
+    def read(self, net_text_input):
+        "Simulate reading the input; the results are then available through word_read and save_readings."
+        if nest.GetKernelStatus('time') > 0.0:
+            reset_kernel_state(self.kernel_seeds)
+        self.prepare(net_text_input)
+
+        # Run the simulation, write readings.
+        begin_step()
+        simulate_focus_period()
+        end_step()
+        while not self.finished:
+            begin_step()
+            self.set_step_weights()
+            simulate_focus_period()
+            self.finish_step()
+            end_step()
+        return self.reading
+
+class BatchReader:
+    """Independent reading circuits (named Readers) in one NEST kernel, reading a batch of inputs
+    while being simulated together.
+
+    There are no connections between the circuits, and they are driven by pregenerated spike trains
+    (see prm['pregenerated_drive']), so each reading is the same as with a single Reader with the
+    pregenerated drive. A circuit which finished reading before the others is still simulated, with
+    its drive silenced, but its reading and spike counts (final_spike_counts) are taken when it
+    finished. Like a Reader, a BatchReader can be kept for later batches (see batch_reader_for).
+    """
+
+    def __init__(self, batch_size, recording_policy=None, text_len=None):
+        self.text_len = text_len or prm['max_text_len']
+        self.kernel_seeds = setup_kernel(recording_policy)
+        self.kernel_build = kernel_builds
+        self.readers = [Reader(recording_policy, self.text_len, name='c{}'.format(reader_n))
+                        for reader_n in range(batch_size)]
+
+    def read(self, net_text_inputs):
+        "Read the inputs (at most as many as the circuits), returning their readings (None for unreadable inputs)."
+        if len(net_text_inputs) > len(self.readers):
+            raise ValueError('{} inputs given to a batch of {} circuits'.format(len(net_text_inputs), len(self.readers)))
+        if nest.GetKernelStatus('time') > 0.0:
+            reset_kernel_state(self.kernel_seeds)
+        active = []
+        reader_ns = self.circuit_numbers(net_text_inputs)
+        self.input_readers = [self.readers[reader_n] for reader_n in reader_ns]
+        input_ns = dict([(reader_n, input_n) for (input_n, reader_n) in enumerate(reader_ns)])
+        for (reader_n, reader) in enumerate(self.readers):
+            if not reader_n in input_ns:
+                reader.drive('') # (a silent circuit)
+                continue
+            try:
+                reader.prepare(net_text_inputs[input_ns[reader_n]])
+                active.append(reader)
+            except ValueError:
+                reader.finished, reader.reading = True, None
+                reader.drive('')
+
+        begin_step()
+        simulate_focus_period()
+        end_step()
+        while [reader for reader in active if not reader.finished]:
+            active = [reader for reader in active if not reader.finished]
+            begin_step()
+            for reader in active:
+                reader.set_step_weights()
+            simulate_focus_period()
+            for reader in active:
+                reader.finish_step()
+            end_step()
+        return [reader.reading for reader in self.input_readers]
+
+    def circuit_numbers(self, net_text_inputs):
+        """Get the numbers of the circuits to read the inputs: the first ones, or with
+        prm['incremental_lexicon'] the ones whose previous inputs are the nearest (in edit distance),
+        so their lexical subnetworks change little."""
+        if not prm['incremental_lexicon']:
+            return list(range(len(net_text_inputs)))
+        previous_inputs = [reader.net_text_input or '' for reader in self.readers]
+        distances = pair_distances([net_text_input for net_text_input in net_text_inputs
+                                    for previous_input in previous_inputs],
+                                   previous_inputs * len(net_text_inputs), 4).reshape((len(net_text_inputs), -1))
+        free = np.ones(len(self.readers), dtype=bool)
+        reader_ns = []
+        for input_distances in distances:
+            reader_n = int(np.argmin(np.where(free, input_distances, distances.max() + 1)))
+            free[reader_n] = False
+            reader_ns.append(reader_n)
+        return reader_ns
+
+@timed('simulate')
+def simulate_focus_period():
+    "Simulate one focus period of reading (a step)."
+    count('steps')
+    nest.Simulate(prm['letter_focus_time'])
+
+def simulate_reading(net_text_input, recording_policy=None, text_len=None):
+    """Build a fresh network (of text_len hypercolumns, network_length by default) and simulate reading
+    the input with it. The recording policy (see prm['recording_policy']) decides which probes record
+    membrane potentials."""
+    Reader(recording_policy, text_len or network_length(net_text_input)).read(net_text_input)
+
+def overlap_order(net_text_inputs, window_size=1000):
+    """Get the numbers of the inputs in an order in which consecutive inputs have many common candidate
+    words (for prm['incremental_lexicon']). Inputs are grouped by their first letter, as candidates are
+    (see candidate_words), and sorted; in each window of window_size inputs, each one is followed by the
+    nearest one (in edit distance) of those left."""
+    first_letter_ns = dict()
+    for (input_n, net_text_input) in enumerate(net_text_inputs):
+        first_letter_ns.setdefault(unidecode(net_text_input[:1]), []).append(input_n)
+    order = []
+    for (first_letter, input_ns) in sorted(first_letter_ns.items()):
+        input_ns.sort(key=lambda input_n: net_text_inputs[input_n])
+        for window_start in range(0, len(input_ns), window_size):
+            window_ns = input_ns[window_start:window_start+window_size]
+            distances = distance_matrix([net_text_inputs[input_n] for input_n in window_ns], 4)
+            left = np.ones(len(window_ns), dtype=bool)
+            position = 0
+            for step_n in range(len(window_ns)):
+                order.append(window_ns[position])
+                left[position] = False
+                if step_n < len(window_ns) - 1:
+                    position = int(np.argmin(np.where(left, distances[position], distances.max() + 1)))
+    return order
+
+def simulate_reading_batch(net_text_inputs, batch_size=None, recording_policy='spikes', collect=None,
+                           batch_reader=None):
+    """Read the inputs with batches of circuits simulated together (see BatchReader), returning the
+    readings in the order of inputs (None for inputs the model cannot read) and the BatchReader to pass
+    for the next inputs (the given one is used if it fits, see batch_reader_for). Inputs with different
+    network lengths (see network_length) are read in separate batches. With prm['incremental_lexicon'],
+    each circuit reads a run of similar inputs (see overlap_order). After each batch, collect (if given)
+    is called with the number of each input and the Reader which read it."""
+    batch_size = batch_size or prm['reading_batch_size']
+    readings = [None] * len(net_text_inputs)
+    length_inputs = dict() # network length -> numbers of inputs
+    for (input_n, net_text_input) in enumerate(net_text_inputs):
+        length_inputs.setdefault(network_length(net_text_input), []).append(input_n)
+    for (text_len, input_ns) in sorted(length_inputs.items()):
+        batches_n = (len(input_ns) + batch_size - 1) // batch_size
+        if prm['incremental_lexicon']:
+            input_ns = [input_ns[n] for n in overlap_order([net_text_inputs[input_n] for input_n in input_ns])]
+            # (the circuit of each place in batches reads a run of consecutive inputs in this order)
+            batches = [input_ns[batch_n::batches_n] for batch_n in range(batches_n)]
+        else:
+            batches = [input_ns[batch_n*batch_size:(batch_n+1)*batch_size] for batch_n in range(batches_n)]
+        for batch_ns in batches:
+            batch_reader = batch_reader_for(text_len, len(batch_ns), batch_reader, recording_policy,
+                                            min(batch_size, len(input_ns)))
+            batch_readings = batch_reader.read([net_text_inputs[input_n] for input_n in batch_ns])
+            for (input_n, reading, reader) in zip(batch_ns, batch_readings, batch_reader.input_readers):
+                readings[input_n] = reading
+                if collect is not None:
+                    collect(input_n, reader)
+    return (readings, batch_reader)
+
+def batch_reader_for(text_len, inputs_n, batch_reader=None, recording_policy=None, batch_size=None):
+    """Get a BatchReader for inputs_n inputs with networks of text_len hypercolumns: the given one if it
+    is still usable, of this length and has enough circuits, otherwise a new one with batch_size
+    circuits (inputs_n by default)."""
+    if (batch_reader is None or batch_reader.kernel_build != kernel_builds
+            or batch_reader.text_len != text_len or len(batch_reader.readers) < inputs_n):
+        batch_reader = BatchReader(max(batch_size or inputs_n, inputs_n), recording_policy, text_len)
+    return batch_reader
+
+def reader_for(net_text_input, reader=None, recording_policy=None):
+    """Get a Reader for the input: the given one if it is still usable and its length fits (see
+    network_length), otherwise a new one, so the reading is the same as with simulate_reading. (With
+    prm['dynamic_length'], inputs of the same network length should come together, see
+    parallel_reading.length_order, or the readers are rebuilt often.)"""
+    if (reader is None or reader.kernel_build != kernel_builds
+            or reader.text_len != network_length(net_text_input)):
+        reader = Reader(recording_policy, network_length(net_text_input))
+    return reader
+
+def spike_counts(spike_groups, spike_decisions):
+    """Get the current spike counts of the spike groups and decisions: ({ label: decisions (see
+    decide_spikes) }, { label: scores (see score_spikes) })."""
+    return (dict([(label, decide_spikes(groups)) for (label, groups) in spike_decisions.items()]),
+            dict([(label, score_spikes(names)) for (label, names) in spike_groups.items()]))
+
+def spike_tables():
+    "Get the spike counts the last reading of the module's Reader decided by: its Reading decisions and Words scores."
+    return (decide_spikes(spike_decisions['Reading']), score_spikes(spike_groups['Words']))
+
+def compare_with_fresh_build(words):
+    """Read all the words with one Reader (see reader_for) and then each word with a network built from
+    nothing (after nest.ResetKernel), returning a list of (word, fresh reading,
+    reader's reading) for words where the readings or the spike counts they are decided by (see
+    spike_tables) differ."""
+    reader = None
+    readings = []
+    for word in words:
+        reader = reader_for(word, reader)
+        reader.read(word)
+        readings.append((reader.text_len, (word_read(), spike_tables())))
+    differences = []
+    for (word, (text_len, reading)) in zip(words, readings):
+        nest.ResetKernel()
+        simulate_reading(word, text_len=text_len)
+        fresh_reading = (word_read(), spike_tables())
+        if reading != fresh_reading:
+            differences.append((word, fresh_reading, reading))
+    return differences
+
+def compare_batch_with_single(words, batch_size=None):
+    """Read the words one by one with the pregenerated drive and then in batches (see
+    simulate_reading_batch), returning a list of (word, single reading, batch reading) for words
+    where they differ."""
+    pregenerated_drive = prm['pregenerated_drive']
+    prm['pregenerated_drive'] = True
+    try:
+        single_readings = []
+        reader = None
+        for word in words:
+            try:
+                reader = reader_for(word, reader, recording_policy='spikes')
+                single_readings.append(reader.read(word))
+            except ValueError:
+                single_readings.append(None)
+    finally:
+        prm['pregenerated_drive'] = pregenerated_drive
+    batch_readings = simulate_reading_batch(words, batch_size)[0]
+    return [(word, single_reading, batch_reading)
+            for (word, single_reading, batch_reading) in zip(words, single_readings, batch_readings)
+            if single_reading != batch_reading]
+
+def reading_from_decisions(word_decisions):
+    """Get the word read from decisions of the Reading groups, and whether it was ended by a grapheme
+    column below decision_threshold."""
+    stop_boundary = len(word_decisions)
+    ended = False
     for dec_n in range(1, len(word_decisions)):
         if word_decisions[dec_n][1] < prm['decision_threshold']:#word_decisions[dec_n-1][1] * 0.56:
             stop_boundary = dec_n
+            ended = True
             break
 
-    return ''.join([dec[0][dec[0].index('-')+1:] for dec in word_decisions[:stop_boundary]])
+    return (''.join([dec[0][dec[0].index('-')+1:] for dec in word_decisions[:stop_boundary]]), ended)
+
+def word_read():
+    if nest.GetKernelStatus('time') == 0.0:
+        raise RuntimeError('calling word_read with no simulation state available')
+
+    word_decisions = decide_spikes(spike_decisions['Reading']) # get columns with their spike counts
+    return reading_from_decisions(word_decisions)[0]
 
 def save_readings(simulation_name, thorough=True):
-    write_readings(prm['readings_path']+simulation_name,
+    """Write the readings of the last simulation to a new directory in prm['readings_path'], returning its
+    path. Charts of probes (all if thorough, otherwise only those always charted) are made from them by
+    render_readings.py."""
+    return write_readings(prm['readings_path']+simulation_name,
                    params=prm,
                    spike_groups=spike_groups,
                    spike_decisions=spike_decisions,
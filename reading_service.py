@@ -0,0 +1,162 @@
+import argparse, asyncio, collections, concurrent.futures, json, multiprocessing, time
+import parallel_reading
+
+# A resident reading service: the worker processes keep the language data and a built network (see
+# parallel_reading) between requests, so a reading costs only the simulation. Clients send one JSON
+# request per line and get one JSON response per line:
+#   { "word": "...", "scores": true }  ->  { "word": ..., "reading": ..., "scores": {...} }
+#   { "stats": true }                  ->  queue depth, readings served and their latencies (s)
+# The reading is null for inputs the model cannot read; spike scores are given only when asked for.
+# Latencies are summarized over the last latencies_kept readings.
+
+latencies_kept = 10000
+
+class ReadingService:
+    "A queue of words read by a pool of worker processes, with statistics of the queue and latencies."
+
+    def __init__(self, workers=1, params=None):
+        self.workers = workers
+        self.params = params or dict()
+        self.queue = None # made when started (it belongs to the running event loop)
+        self.pool = None
+        self.in_progress_n = 0
+        self.served_n = 0
+        self.failed_n = 0
+        self.latencies = collections.deque(maxlen=latencies_kept) # (from queueing to the result)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        context = multiprocessing.get_context('spawn') # (NEST kernels don't survive forking)
+        self.pool = concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context,
+                                                           initializer=parallel_reading.warm_up_worker,
+                                                           initargs=(self.params,))
+        # Each worker process has one task taking words from the queue, so words wait in the queue
+        # (and count in its depth) until a worker is free.
+        self.tasks = [asyncio.ensure_future(self.serve_queue()) for worker_n in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        self.pool.shutdown()
+
+    async def serve_queue(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            word, with_scores, queued_time, result = await self.queue.get()
+            self.in_progress_n += 1
+            try:
+                reading = await loop.run_in_executor(self.pool, parallel_reading.read_case_scored,
+                                                     word, with_scores)
+                self.served_n += 1
+                self.latencies.append(time.perf_counter() - queued_time)
+                result.set_result(reading)
+            except Exception as exc:
+                self.failed_n += 1
+                result.set_exception(exc)
+            finally:
+                self.in_progress_n -= 1
+                self.queue.task_done()
+
+    async def read(self, word, with_scores=False):
+        "Queue the word and wait for its reading (see parallel_reading.read_case_scored)."
+        result = asyncio.get_running_loop().create_future()
+        await self.queue.put((word, with_scores, time.perf_counter(), result))
+        return await result
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        return { 'workers': self.workers,
+                 'queue_depth': self.queue.qsize(),
+                 'in_progress': self.in_progress_n,
+                 'served': self.served_n,
+                 'failed': self.failed_n,
+                 'mean_latency': sum(latencies) / len(latencies) if latencies else None,
+                 'median_latency': latencies[len(latencies)//2] if latencies else None,
+                 'max_latency': latencies[-1] if latencies else None }
+
+    async def handle_request(self, request):
+        if request.get('stats'):
+            return self.stats()
+        if not isinstance(request.get('word'), str):
+            return { 'error': 'the request needs a word (string) or stats' }
+        try:
+            reading = await self.read(request['word'], bool(request.get('scores')))
+        except Exception as exc:
+            return { 'word': request['word'], 'error': repr(exc) }
+        return dict(reading, word=request['word'])
+
+    async def handle_client(self, reader, writer):
+        # (requests of one client are answered in order; concurrent clients share the queue)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode())
+                except ValueError:
+                    response = { 'error': 'requests should be JSON objects, one in a line' }
+                else:
+                    if isinstance(request, dict):
+                        response = await self.handle_request(request)
+                    else:
+                        response = { 'error': 'requests should be JSON objects, one in a line' }
+                writer.write((json.dumps(response, ensure_ascii=False) + '\n').encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+async def serve(service, host='127.0.0.1', port=8765, socket_path=None):
+    "Run the service on the port (of the host) or on the Unix socket, until cancelled."
+    await service.start()
+    if socket_path is not None:
+        server = await asyncio.start_unix_server(service.handle_client, socket_path)
+    else:
+        server = await asyncio.start_server(service.handle_client, host, port)
+    try:
+        await asyncio.Event().wait() # (forever)
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.stop()
+
+def request(request, host='127.0.0.1', port=8765, socket_path=None):
+    "Send a request (a dict, see above) to a running service and return its response."
+    import socket
+    if socket_path is not None:
+        connection = socket.socket(socket.AF_UNIX)
+        connection.connect(socket_path)
+    else:
+        connection = socket.create_connection((host, port))
+    with connection, connection.makefile('rwb') as stream:
+        stream.write((json.dumps(request, ensure_ascii=False) + '\n').encode())
+        stream.flush()
+        return json.loads(stream.readline().decode())
+
+def positive_int(arg):
+    value = int(arg)
+    if value < 1:
+        raise argparse.ArgumentTypeError('should be at least 1: {}'.format(arg))
+    return value
+
+argparser = argparse.ArgumentParser(description='Serve readings of words over a local socket (JSON lines).')
+argparser.add_argument('--host', default='127.0.0.1')
+argparser.add_argument('--port', type=int, default=8765)
+argparser.add_argument('--socket', metavar='PATH', help='listen on a Unix socket instead of a port')
+argparser.add_argument('--workers', type=int, default=1, help='number of simulation worker processes (default 1)')
+argparser.add_argument('--threads', type=int, help='NEST threads in each worker (default from prm)')
+argparser.add_argument('--early-stopping', type=positive_int, metavar='STEPS',
+                       help='stop reading a word after its reading is stable for this many steps'
+                            ' (default from prm)')
+
+if __name__ == '__main__': # (worker processes import this file too)
+    args = argparser.parse_args()
+    params = { 'recording_policy': 'spikes' } # (membrane potentials are not served)
+    if args.threads is not None:
+        params['local_num_threads'] = args.threads
+    if args.early_stopping is not None:
+        params['early_stopping_steps'] = args.early_stopping
+    try:
+        asyncio.run(serve(ReadingService(args.workers, params), args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
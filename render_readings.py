@@ -0,0 +1,81 @@
+import argparse, multiprocessing
+import numpy as np
+
+# Charting readings written by save_readings (see neuro_reporting.write_events): spikes and membrane
+# potentials of probes, as PNG files in the readings directory, made by a pool of worker processes.
+
+readings_file_name = 'readings.npz' # (as in neuro_reporting, which is not imported here, as it needs NEST)
+
+worker_state = dict()
+
+def load_events(path):
+    "Load the events file of the readings directory, as a dict of arrays."
+    with np.load(path+readings_file_name) as events:
+        return dict(events.items())
+
+def init_worker(path):
+    worker_state['path'] = path
+    worker_state['events'] = load_events(path)
+
+def probe_events(events, probe_n):
+    "Get (spike times, spike senders, voltage times, voltage values) arrays of the probe."
+    cells = events['probe_cells'][events['probe_cells_start'][probe_n]:events['probe_cells_start'][probe_n+1]]
+    own_spikes = ((events['spike_layers'] == events['probe_layers'][probe_n])
+                  & np.isin(events['spike_senders'], cells))
+    own_voltages = events['voltage_probes'] == probe_n
+    return (events['spike_times'][own_spikes], events['spike_senders'][own_spikes],
+            events['voltage_times'][own_voltages], events['voltage_values'][own_voltages])
+
+def render_probe(probe_n):
+    "Chart the probe's membrane potentials (if recorded) and spikes."
+    import pylab
+    path, events = worker_state['path'], worker_state['events']
+    name = str(events['probe_names'][probe_n])
+    spike_times, spike_senders, voltage_times, voltage_values = probe_events(events, probe_n)
+    if len(voltage_times) > 0:
+        fig = pylab.figure()
+        pylab.plot(voltage_times, voltage_values)
+        pylab.ticklabel_format(useOffset=False, style='plain') # disable offsets and scientific notation
+        pylab.savefig(path+name+'_membrane_potential.png')
+        pylab.close(fig)
+
+    fig = pylab.figure()
+    pylab.plot(spike_times, spike_senders, '.')
+    pylab.ticklabel_format(useOffset=False, style='plain')
+    pylab.savefig(path+name+'_spikes.png')
+    pylab.close(fig)
+    return name
+
+def render_readings(path, probe_names=None, thorough=False, workers=1):
+    """Chart the probes of readings in the directory: the given ones, or those marked to be charted
+    (all if thorough). Returns the names of probes charted."""
+    if not path.endswith('/'):
+        path += '/'
+    events = load_events(path)
+    names = [str(name) for name in events['probe_names']]
+    if probe_names is not None:
+        unknown = [name for name in probe_names if not name in names]
+        if unknown:
+            raise KeyError('no probes {} in the readings'.format(', '.join(unknown)))
+        probe_ns = [names.index(name) for name in probe_names]
+    else:
+        probe_ns = [probe_n for probe_n in range(len(names)) if thorough or events['probe_charted'][probe_n]]
+    if workers == 1:
+        init_worker(path)
+        return [render_probe(probe_n) for probe_n in probe_ns]
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers, initializer=init_worker, initargs=(path,)) as pool:
+        return pool.map(render_probe, probe_ns, chunksize=max(1, len(probe_ns) // (workers * 4)))
+
+argparser = argparse.ArgumentParser(description='Chart the probes of readings saved by save_readings.')
+argparser.add_argument('readings_path', metavar='READINGS_DIR')
+argparser.add_argument('probes', metavar='PROBE', nargs='*',
+                       help='names of probes to chart (default: those marked when saving)')
+argparser.add_argument('--thorough', action='store_true', help='chart all the probes')
+argparser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                       help='number of worker processes (default: the number of CPUs)')
+
+if __name__ == '__main__': # (worker processes import this file too)
+    args = argparser.parse_args()
+    charted = render_readings(args.readings_path, args.probes or None, args.thorough, args.workers)
+    print('{} probes charted'.format(len(charted)))
@@ -0,0 +1,176 @@
+import argparse, itertools, json, multiprocessing, os, random, resource, subprocess, time
+
+# Measure how the costs of reading scale with the language and the network: synthetic language packs
+# (in the format of the language data, see language_data.py) are generated for each vocabulary size and
+# grapheme inventory, and each point of the grid (pack, input length, max_text_len) is measured in a
+# separate process, so the memory measurements are not mixed up. The results are written as JSON lines,
+# with the commit of the code, so they can be compared across versions.
+
+def random_word(rng, graphemes, length):
+    "Make a word of the given length (in letters) from random graphemes."
+    word = ''
+    while len(word) < length:
+        fitting = [g for g in graphemes if len(g) <= length - len(word)]
+        word += rng.choice(fitting)
+    return word
+
+def check_pack_sizes(vocabulary_n, graphemes_n, letters_n, suffixes_n):
+    "Raise ValueError if a language pack cannot have so many distinct graphemes, suffixes or words."
+    short_strings_n = letters_n + letters_n**2 + letters_n**3 # (of one to three letters)
+    if graphemes_n > short_strings_n:
+        raise ValueError('at most {} graphemes can be made of {} letters'.format(short_strings_n, letters_n))
+    if suffixes_n > short_strings_n:
+        raise ValueError('at most {} suffixes can be made of {} letters'.format(short_strings_n, letters_n))
+    words_n = sum([letters_n**length for length in range(3, 14)]) # (3 to 10 letters and a suffix)
+    if vocabulary_n > words_n:
+        raise ValueError('at most {} words can be made of {} letters'.format(words_n, letters_n))
+
+def make_language_pack(path, vocabulary_n, graphemes_n, letters_n=20, suffixes_n=20, seed=0):
+    """Write a synthetic language pack to the path: letters_n letters, graphemes_n graphemes (the letters
+    and random combinations of two or three of them), vocabulary_n words made of graphemes, their stems
+    (the words without a suffix, if they end in one) and suffixes_n suffixes. Raises ValueError for
+    sizes that cannot be reached (see check_pack_sizes)."""
+    check_pack_sizes(vocabulary_n, graphemes_n, letters_n, suffixes_n)
+    rng = random.Random(seed)
+    letters = [chr(ord('a') + letter_n) for letter_n in range(letters_n)]
+    graphemes = list(letters)
+    while len(graphemes) < graphemes_n:
+        grapheme = ''.join(rng.choice(letters) for letter_n in range(rng.choice([2, 3])))
+        if not grapheme in graphemes:
+            graphemes.append(grapheme)
+    suffixes = set()
+    while len(suffixes) < suffixes_n:
+        suffixes.add(random_word(rng, graphemes, rng.randint(1, 3)))
+    suffixes = sorted(suffixes)
+    vocabulary = set()
+    while len(vocabulary) < vocabulary_n:
+        word = random_word(rng, graphemes, rng.randint(3, 10))
+        if rng.random() < 0.5:
+            word += rng.choice(suffixes)
+        vocabulary.add(word)
+    vocabulary = sorted(vocabulary)
+    stems = set()
+    for word in vocabulary:
+        ending = [suffix for suffix in suffixes if word.endswith(suffix) and len(word) > len(suffix) + 1]
+        stems.add(word[:-len(ending[0])] if ending else word)
+    os.makedirs(path, exist_ok=True)
+    for (file_name, items) in [('letters', letters), ('graphemes', graphemes), ('vocabulary', vocabulary),
+                               ('stems', sorted(stems)), ('suffixes', suffixes)]:
+        with open(path+file_name, 'w') as fl:
+            print('\n'.join(items), file=fl)
+
+def measure(language_data_path, stems_and_suffixes, input_len, max_text_len, threads):
+    """Load the language, build a reader and read a word of the input length with it, in the current
+    process. Returns a dict of measurements."""
+    import nest
+    import reading_model
+    reading_model.prm.update({ 'language_data_path': language_data_path,
+                               'stems_and_suffixes': stems_and_suffixes,
+                               'max_text_len': max_text_len,
+                               'recording_policy': 'spikes',
+                               'reading_cache_bypass': True })
+    if threads is not None:
+        reading_model.prm['local_num_threads'] = threads
+    start = time.perf_counter()
+    language = reading_model.language()
+    load_time = time.perf_counter() - start
+    words = [word for word in itertools.chain.from_iterable(language.vocabulary.values())
+             if len(word) == input_len]
+    word = random.Random(input_len).choice(words) if words else 'a' * input_len
+
+    reading_model.enable_instrumentation()
+    start = time.perf_counter()
+    reader = reading_model.reader_for(word)
+    build_time = time.perf_counter() - start
+    build_stats = reading_model.take_stats()
+    neurons_n, connections_n = nest.GetKernelStatus(['network_size', 'num_connections'])
+    start = time.perf_counter()
+    reader.read(word)
+    read_time = time.perf_counter() - start
+    read_stats = reading_model.take_stats()
+    return { 'word': word,
+             'load_time': load_time,
+             'build_time': build_time,
+             'read_time': read_time,
+             'build_phases': build_stats.phases,
+             'read_phases': read_stats.phases,
+             'counters': dict((name, build_stats.counters.get(name, 0) + read_stats.counters.get(name, 0))
+                              for name in set(build_stats.counters) | set(read_stats.counters)),
+             'network_size': neurons_n,
+             'connections': connections_n,
+             'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 }
+
+def code_version():
+    "Get the commit of the code (None outside a git repository)."
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def int_list(arg):
+    return [int(value) for value in arg.split(',')]
+
+argparser = argparse.ArgumentParser(description='Measure loading, building and reading costs on synthetic'
+                                                ' language packs, over a grid of sizes.')
+argparser.add_argument('--vocabulary', type=int_list, default=[100, 1000, 10000],
+                       help='vocabulary sizes (comma-separated, default 100,1000,10000)')
+argparser.add_argument('--graphemes', type=int_list, default=[30],
+                       help='grapheme inventory sizes (comma-separated, default 30)')
+argparser.add_argument('--input-lengths', type=int_list, default=[4, 8],
+                       help='lengths of the words read (comma-separated, default 4,8)')
+argparser.add_argument('--max-text-len', type=int_list, default=[12],
+                       help='values of prm max_text_len (comma-separated, default 12)')
+argparser.add_argument('--letters', type=int, default=20, help='letters in the packs (at most 26, default 20)')
+argparser.add_argument('--suffixes', type=int, default=20, help='suffixes in the packs (default 20)')
+argparser.add_argument('--no-suffixes', action='store_true',
+                       help='read with the whole vocabulary instead of stems and suffixes')
+argparser.add_argument('--repeats', type=int, default=1, help='measurements of each grid point (default 1)')
+argparser.add_argument('--threads', type=int, help='NEST threads (default from prm)')
+argparser.add_argument('--packs-dir', default='benchmark_packs/',
+                       help='where the language packs are generated (and reused from; default benchmark_packs/)')
+argparser.add_argument('--output', default='scaling_benchmark.jsonl',
+                       help='file the results are appended to (default scaling_benchmark.jsonl)')
+
+if __name__ == '__main__':
+    args = argparser.parse_args()
+    if not (1 <= args.letters <= 26):
+        argparser.error('--letters should be between 1 and 26')
+    try:
+        for (vocabulary_n, graphemes_n) in itertools.product(args.vocabulary, args.graphemes):
+            check_pack_sizes(vocabulary_n, max(graphemes_n, args.letters), args.letters, args.suffixes)
+    except ValueError as exc:
+        argparser.error(str(exc))
+    version = code_version()
+    context = multiprocessing.get_context('spawn')
+    print('{:>10} {:>9} {:>6} {:>8} {:>9} {:>10} {:>9} {:>12} {:>13}'.format(
+        'vocabulary', 'graphemes', 'input', 'max len', 'load (s)', 'build (s)', 'read (s)', 'connections',
+        'max RSS (MB)'))
+    with open(args.output, 'a') as output_file:
+        for (vocabulary_n, graphemes_n) in itertools.product(args.vocabulary, args.graphemes):
+            pack_path = '{}v{}_g{}_l{}_s{}/'.format(args.packs_dir, vocabulary_n, graphemes_n, args.letters,
+                                                    args.suffixes)
+            if not os.path.exists(pack_path+'letters'):
+                make_language_pack(pack_path, vocabulary_n, max(graphemes_n, args.letters), args.letters,
+                                   args.suffixes)
+            for (input_len, max_text_len, repeat_n) in itertools.product(args.input_lengths, args.max_text_len,
+                                                                         range(args.repeats)):
+                if input_len > max_text_len:
+                    continue
+                with context.Pool(1) as pool:
+                    result = pool.apply(measure, (pack_path, not args.no_suffixes, input_len, max_text_len,
+                                                  args.threads))
+                result.update({ 'version': version,
+                                'vocabulary': vocabulary_n,
+                                'graphemes': graphemes_n,
+                                'letters': args.letters,
+                                'suffixes': args.suffixes,
+                                'stems_and_suffixes': not args.no_suffixes,
+                                'input_len': input_len,
+                                'max_text_len': max_text_len,
+                                'threads': args.threads,
+                                'repeat': repeat_n })
+                print(json.dumps(result, ensure_ascii=False), file=output_file, flush=True)
+                print('{:>10} {:>9} {:>6} {:>8} {:>9.2f} {:>10.2f} {:>9.2f} {:>12} {:>13.1f}'.format(
+                    vocabulary_n, graphemes_n, input_len, max_text_len, result['load_time'],
+                    result['build_time'], result['read_time'], result['connections'], result['max_rss_mb']))
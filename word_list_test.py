@@ -1,35 +1,184 @@
-import csv, sys
-
-if len(sys.argv) != 2:
-    print('Usage: python3 word_list_test.py FILE_WITH_CASES')
-    sys.exit(-1)
-
-from reading_model import simulate_reading, word_read
-
-cases = []
-with open(sys.argv[1]) as fl:
-    reader = csv.reader(fl)
-    cases = [row[:2] for row in reader if row]
-
-observations = []
-
-good = 0
-for (word, expected_form) in cases:
-    try:
-        simulate_reading(word)
-    except ValueError:
-        observations.append((word, '____', 'x'))
-        continue
-    prediction = word_read()
-    grade = 'x'
-    if prediction == expected_form:
-        good += 1
-        grade = ''
-    observations.append((word, prediction, grade))
-    print('.', end='')
-
-print()
-print('=== Observations ===')
-for (word, prediction, grade) in observations:
-    print(word, prediction, grade)
-print('accuracy', good / len(cases))
+import argparse, csv, itertools, json, os, time
+
+def positive_int(arg):
+    value = int(arg)
+    if value < 1:
+        raise argparse.ArgumentTypeError('should be at least 1: {}'.format(arg))
+    return value
+
+argparser = argparse.ArgumentParser(description='Read the words from a CSV file with cases (word, expected form)'
+                                                ' and report the accuracy.')
+argparser.add_argument('cases_path', metavar='FILE_WITH_CASES')
+argparser.add_argument('--workers', type=int, default=1,
+                       help='number of worker processes reading the words (default 1, no pool)')
+argparser.add_argument('--threads', type=int,
+                       help='NEST threads in each worker (default from prm)')
+argparser.add_argument('--early-stopping', type=positive_int, metavar='STEPS',
+                       help='stop reading a word after its reading is stable for this many steps'
+                            ' (default from prm)')
+argparser.add_argument('--dynamic-length', action='store_true',
+                       help='size the networks to the words (see prm dynamic_length)')
+argparser.add_argument('--batch-size', type=int,
+                       help='read this many words at once, with circuits simulated together in one kernel'
+                            ' (the letters are then driven by pregenerated spike trains, so the readings match'
+                            ' single readings with prm pregenerated_drive, not the default ones)')
+argparser.add_argument('--no-cache', action='store_true',
+                       help='neither take readings from the reading cache nor store them there')
+argparser.add_argument('--incremental-lexicon', action='store_true',
+                       help='update the lexical subnetwork between similar words instead of replacing it (see prm'
+                            ' incremental_lexicon; the readings then depend on the words read before and are not'
+                            ' cached); without --output, the words are read in order of similarity')
+argparser.add_argument('--stats', metavar='FILE',
+                       help='write a JSON line with phase times and counters of each reading to this file'
+                            ' (not with --batch-size)')
+argparser.add_argument('--output', metavar='FILE',
+                       help='stream the results as JSON lines to this file, reading the cases lazily; cases already'
+                            ' in the file (from an interrupted run) are skipped')
+argparser.add_argument('--report-every', type=int, default=50, metavar='N',
+                       help='with --output, report the running accuracy and speed every N words (default 50)')
+
+def read_cases(cases_path, skipped_ns=None):
+    "Yield (case number, word, expected form) from the CSV file, except the case numbers skipped."
+    skipped_ns = skipped_ns or set()
+    with open(cases_path) as fl:
+        for (case_n, row) in enumerate(row for row in csv.reader(fl) if row):
+            if not case_n in skipped_ns:
+                yield (case_n, row[0], row[1])
+
+length_window_size = 1000 # cases grouped by network length at a time, with --output and --dynamic-length
+max_incremental_chunksize = 100 # (so the pool is still fed in bounded windows, see parallel_reading.run_tasks)
+
+def incremental_chunksize(cases_n, workers, batch_size=None):
+    """Get the chunk size (in words, or batches) giving each worker runs of consecutive words, so their
+    lexical subnetworks are updated between similar words (see prm incremental_lexicon)."""
+    tasks_n = cases_n if batch_size is None else (cases_n + batch_size - 1) // batch_size
+    return max(1, min(tasks_n // (workers * 4), max_incremental_chunksize))
+
+def length_grouped(cases, params):
+    """Yield the cases in windows of length_window_size, each ordered by the network lengths of the words
+    (see parallel_reading.length_order), so the workers seldom rebuild their readers."""
+    from parallel_reading import length_order
+    cases = iter(cases)
+    for window in iter(lambda: list(itertools.islice(cases, length_window_size)), []):
+        yield from [window[n] for n in length_order([word for (case_n, word, expected_form) in window], params)]
+
+def load_results(output_path):
+    """Get the results already in the output file, as a dict case number -> result. A line cut off by an
+    interrupted run is ended, so new results start in a new line."""
+    results = dict()
+    if not os.path.exists(output_path):
+        return results
+    with open(output_path, 'rb+') as fl:
+        contents = fl.read()
+        if contents and not contents.endswith(b'\n'):
+            fl.write(b'\n')
+    for line in contents.decode().splitlines():
+        try:
+            result = json.loads(line)
+            results[result['case']] = result
+        except (ValueError, KeyError, TypeError):
+            pass # (a line cut off)
+    return results
+
+if __name__ == '__main__': # (worker processes import this file too)
+    args = argparser.parse_args()
+    if args.stats is not None and args.batch_size is not None:
+        argparser.error('--stats cannot be used with --batch-size')
+
+    from parallel_reading import read_words
+    from parallel_reading import length_order
+    from reading_model import overlap_order
+
+    params = { 'recording_policy': 'spikes' } # (membrane potentials are not used here)
+    if args.threads is not None:
+        params['local_num_threads'] = args.threads
+    if args.early_stopping is not None:
+        params['early_stopping_steps'] = args.early_stopping
+    if args.dynamic_length:
+        params['dynamic_length'] = True
+    if args.no_cache:
+        params['reading_cache_bypass'] = True
+    if args.incremental_lexicon:
+        params['incremental_lexicon'] = True
+    chunksize = 1
+
+    stats_file = None
+    if args.stats is not None:
+        # (a resumed run adds to the stats of the interrupted one)
+        stats_file = open(args.stats, 'a' if args.output is not None else 'w')
+
+    def readings(cases):
+        "Yield the cases (case number, word, expected form) with their readings."
+        # (the cases go with their words through the workers, as tags)
+        tagged_words = ((case, case[1]) for case in cases)
+        for ((case_n, word, expected_form), result) in read_words(tagged_words, workers=args.workers, params=params,
+                                                                  chunksize=chunksize, batch_size=args.batch_size,
+                                                                  with_stats=stats_file is not None, tagged=True):
+            if stats_file is not None:
+                prediction, stats = result
+                print(json.dumps(dict(stats, word=word, reading=prediction), ensure_ascii=False), file=stats_file,
+                      flush=True)
+            else:
+                prediction = result
+            yield (case_n, word, expected_form, prediction)
+
+    if args.output is not None:
+        results = load_results(args.output)
+        good = len([result for result in results.values() if result['good']])
+        read_n = len(results)
+        if results:
+            print('{} cases already read, accuracy {:.4f}'.format(read_n, good / read_n))
+        if args.incremental_lexicon:
+            # (the cases left are counted without keeping them)
+            remaining_n = sum(1 for case in read_cases(args.cases_path, set(results)))
+            chunksize = incremental_chunksize(remaining_n, args.workers, args.batch_size)
+        start, new_n = time.perf_counter(), 0
+        with open(args.output, 'a') as output_file:
+            cases = read_cases(args.cases_path, set(results))
+            if args.dynamic_length:
+                cases = length_grouped(cases, params)
+            for (case_n, word, expected_form, prediction) in readings(cases):
+                result = { 'case': case_n, 'word': word, 'expected': expected_form, 'reading': prediction,
+                           'good': prediction == expected_form }
+                print(json.dumps(result, ensure_ascii=False), file=output_file, flush=True)
+                read_n += 1
+                new_n += 1
+                good += int(result['good'])
+                if new_n % args.report_every == 0:
+                    print('{} read, accuracy {:.4f}, {:.2f} words/s'.format(
+                        read_n, good / read_n, new_n / (time.perf_counter() - start)), flush=True)
+        if read_n:
+            print('accuracy', good / read_n)
+    else:
+        cases = list(read_cases(args.cases_path))
+        ordered_cases = cases
+        if args.incremental_lexicon:
+            ordered_cases = [cases[n] for n in overlap_order([word for (case_n, word, expected_form) in cases])]
+            # (each worker gets runs of similar words)
+            chunksize = incremental_chunksize(len(cases), args.workers, args.batch_size)
+        if args.dynamic_length:
+            # (the order within each length is kept, so runs of similar words stay together)
+            ordered_cases = [ordered_cases[n] for n in length_order([word for (case_n, word, expected_form)
+                                                                     in ordered_cases], params)]
+        observations = dict() # case number -> observation
+
+        good = 0
+        for (case_n, word, expected_form, prediction) in readings(iter(ordered_cases)):
+            if prediction is None:
+                observations[case_n] = (word, '____', 'x')
+                continue
+            grade = 'x'
+            if prediction == expected_form:
+                good += 1
+                grade = ''
+            observations[case_n] = (word, prediction, grade)
+            print('.', end='', flush=True)
+
+        print()
+        print('=== Observations ===')
+        for (word, prediction, grade) in [observations[case_n] for (case_n, word, expected_form) in cases]:
+            print(word, prediction, grade)
+        print('accuracy', good / len(cases))
+
+    if stats_file is not None:
+        stats_file.close()